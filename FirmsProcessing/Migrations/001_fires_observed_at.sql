@@ -0,0 +1,8 @@
+-- Единая метка времени наблюдения вместо выражения acq_date + acq_time::interval,
+-- чтобы отбор точек для архивации шел по индексу, а не полным просмотром fires.
+-- Колонка вычисляется самой БД: строки любого источника записи попадают под отсечку архивации.
+ALTER TABLE fires ADD COLUMN IF NOT EXISTS observed_at TIMESTAMP GENERATED ALWAYS AS (acq_date + acq_time) STORED;
+ALTER TABLE archived_fires ADD COLUMN IF NOT EXISTS observed_at TIMESTAMP GENERATED ALWAYS AS (acq_date + acq_time) STORED;
+
+CREATE INDEX IF NOT EXISTS fires_observed_at_idx ON fires (observed_at);
+CREATE INDEX IF NOT EXISTS archived_fires_observed_at_idx ON archived_fires (observed_at);
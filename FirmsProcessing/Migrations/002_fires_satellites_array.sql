@@ -0,0 +1,7 @@
+-- Набор спутников в виде массива: проверка и дополнение без разбора строки через split(',').
+-- Строковая колонка satellite сохраняется и поддерживается для совместимости с дашбордами.
+ALTER TABLE fires ADD COLUMN IF NOT EXISTS satellites TEXT[];
+ALTER TABLE archived_fires ADD COLUMN IF NOT EXISTS satellites TEXT[];
+
+UPDATE fires SET satellites = string_to_array(satellite, ',') WHERE satellites IS NULL;
+UPDATE archived_fires SET satellites = string_to_array(satellite, ',') WHERE satellites IS NULL;
@@ -0,0 +1,17 @@
+-- Сводка по лесничеству и дню для дашбордов: чтение без соединения fires, archived_fires и таблиц связей.
+-- Поддерживается пакетной записью process_data.py и archive_data.py. Заполняет ее по уже существующим
+-- данным fire_aggregates.fill_aggregates сразу после этой миграции (db_migrations.post_migration_steps).
+CREATE TABLE IF NOT EXISTS fire_daily_aggregates (
+    forestry_id BIGINT NOT NULL,
+    acq_date DATE NOT NULL,
+    fire_count INTEGER NOT NULL DEFAULT 0,
+    day_count INTEGER NOT NULL DEFAULT 0,
+    night_count INTEGER NOT NULL DEFAULT 0,
+    max_frp DOUBLE PRECISION,
+    max_brightness DOUBLE PRECISION,
+    satellites TEXT[] NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (forestry_id, acq_date)
+);
+
+CREATE INDEX IF NOT EXISTS fire_daily_aggregates_acq_date_idx ON fire_daily_aggregates (acq_date);
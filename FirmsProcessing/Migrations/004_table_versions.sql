@@ -0,0 +1,21 @@
+-- Счетчик изменений справочных таблиц: долгоживущий процесс сверяет его перед каждым запуском
+-- вместо полного хэширования геометрий лесов.
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO table_versions (table_name) VALUES ('forestry_geometries') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1, changed_at = NOW() WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS forestry_geometries_version ON forestry_geometries;
+CREATE TRIGGER forestry_geometries_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON forestry_geometries
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
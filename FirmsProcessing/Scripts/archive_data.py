@@ -1,9 +1,17 @@
+import os
+import time
 import psycopg2
-from datetime import datetime, timedelta
+from datetime import timedelta
 import logging
 
+from db_migrations import apply_migrations
+from fire_aggregates import subtract_archive_duplicates
+from partitions import apply_archive_retention, detach_partition, ensure_partitions, expired_partitions, is_partitioned
+
+from pipeline_metrics import CountingCursor, metered_run, setup_logging, stage_timer
+
 # Настройка логирования
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename='/var/log/app.log')
+setup_logging()
 logging.info('Starting archive script execution.')
 
 db_config = {
@@ -13,91 +21,232 @@ db_config = {
     "password": os.getenv('DB_PASSWORD')
 }
 
-def archive_old_points(cur, cutoff_time):
-    global archived_points_all_files
+# Размер порции: каждая порция переносится и фиксируется отдельной транзакцией
+archive_chunk_size = int(os.getenv('ARCHIVE_CHUNK_SIZE', '5000'))
+
+# observed_at в архиве вычисляется самой БД
+archived_columns = ("latitude", "longitude", "brightness", "scan", "track", "acq_date", "acq_time", "local_time",
+                    "satellite", "satellites", "confidence", "version", "bright_t31", "frp", "daynight", "geom")
+
+def create_archive_map(cur):
+    # Явное соответствие старого id в fires новому id в archived_fires
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS archive_map (
+            old_id BIGINT PRIMARY KEY,
+            new_id BIGINT,
+            inserted BOOLEAN NOT NULL DEFAULT FALSE
+        )
+    """)
+    # Связи, которые порция действительно добавила в архив, — по ним пересчитывается сводка
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS archive_moved_relations (
+            fire_id BIGINT NOT NULL,
+            forestry_id INTEGER NOT NULL
+        )
+    """)
+    cur.execute("TRUNCATE archive_map, archive_moved_relations")
+
+def select_archive_chunk(cur, source_table, cutoff_time, last_id, chunk_size, skip_locked=True):
+    # Новые id выдаются заранее из последовательности archived_fires, чтобы связь не зависела от порядка RETURNING.
+    # Занятые строки построчный перенос забирает в следующий запуск; секции, которую потом удаляют, ждать их нужно
+    cur.execute(f"""
+        INSERT INTO archive_map (old_id, new_id)
+        SELECT id, nextval(pg_get_serial_sequence('archived_fires', 'id'))
+        FROM (
+            SELECT id FROM {source_table}
+            WHERE observed_at < %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE {'SKIP LOCKED' if skip_locked else ''}
+        ) expired
+    """, (cutoff_time, last_id, chunk_size))
+    return cur.rowcount
+
+def move_chunk_to_archive(cur, source_table, delete_source=True):
+    columns = ", ".join(archived_columns)
+    cur.execute(f"""
+        WITH inserted AS (
+            INSERT INTO archived_fires (id, {columns}, archived_at)
+            SELECT m.new_id, {', '.join('f.' + column for column in archived_columns)}, NOW()
+            FROM archive_map m
+            JOIN {source_table} f ON f.id = m.old_id
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        )
+        UPDATE archive_map m
+        SET inserted = TRUE
+        FROM inserted i
+        WHERE m.new_id = i.id
+    """)
+    inserted_points = cur.rowcount
+
+    # Точка уже есть в архиве: привязываемся к существующей записи, как и раньше
+    cur.execute(f"""
+        UPDATE archive_map m
+        SET new_id = (
+            SELECT a.id FROM archived_fires a
+            WHERE a.acq_date = f.acq_date AND a.acq_time = f.acq_time AND a.geom = f.geom
+            ORDER BY a.id
+            LIMIT 1
+        )
+        FROM {source_table} f
+        WHERE f.id = m.old_id AND NOT m.inserted
+    """)
+
+    cur.execute("""
+        WITH moved AS (
+            INSERT INTO archived_fire_forest_relations (fire_id, forestry_id)
+            SELECT m.new_id, r.forestry_id
+            FROM archive_map m
+            JOIN fire_forest_relations r ON r.fire_id = m.old_id
+            WHERE m.new_id IS NOT NULL
+            ON CONFLICT DO NOTHING
+            RETURNING fire_id, forestry_id
+        )
+        INSERT INTO archive_moved_relations SELECT fire_id, forestry_id FROM moved
+    """)
+    moved_relations = cur.rowcount
+    subtract_archive_duplicates(cur, source_table)
+
+    # Точки без пары в архиве остаются в fires до следующего запуска, чтобы не потерять данные
+    cur.execute("""
+        DELETE FROM fire_forest_relations r
+        USING archive_map m
+        WHERE r.fire_id = m.old_id AND m.new_id IS NOT NULL
+    """)
+    cur.execute("SELECT count(*) FROM archive_map WHERE new_id IS NOT NULL")
+    archived_points = cur.fetchone()[0]
+    # Секцию целиком потом отсоединяют и удаляют, построчный DELETE для нее не нужен
+    if delete_source:
+        cur.execute(f"""
+            DELETE FROM {source_table} f
+            USING archive_map m
+            WHERE f.id = m.old_id AND m.new_id IS NOT NULL
+        """)
+    return inserted_points, archived_points, moved_relations
+
+def archive_old_points(cur, conn, cutoff_time, chunk_size=None):
+    chunk_size = chunk_size or archive_chunk_size
     logging.info(f"Cutoff time for archiving: {cutoff_time}")
 
-    try:
-        cur.execute("""
-            SELECT id, latitude, longitude, acq_date, acq_time
-            FROM fires
-            WHERE acq_date + acq_time::interval < %s
-        """, (cutoff_time,))
-        
-        points_to_archive = cur.fetchall()
-        logging.info(f"Points to archive: {len(points_to_archive)}")
-
-        if not points_to_archive:
-            return
-
-        archived_ids = []
-        for point in points_to_archive:
-            cur.execute("""
-                INSERT INTO archived_fires (latitude, longitude, brightness, scan, track, acq_date, acq_time, local_time, satellite, confidence, version, bright_t31, frp, daynight, geom, archived_at)
-                SELECT latitude, longitude, brightness, scan, track, acq_date, acq_time, local_time, satellite, confidence, version, bright_t31, frp, daynight, geom, NOW()
-                FROM fires
-                WHERE id = %s
-                ON CONFLICT DO NOTHING
-                RETURNING id
-            """, (point[0],))
-            
-            new_archived_id = cur.fetchone()
-            if new_archived_id:
-                archived_ids.append(new_archived_id[0])
-            else:
-                cur.execute("""
-                    SELECT id FROM archived_fires WHERE acq_date = %s AND acq_time = %s AND geom = ST_GeomFromText('POINT(%s %s)', 4326)
-                """, (point[3], point[4], point[2], point[1]))
-                existing_archived_id = cur.fetchone()
-                if existing_archived_id:
-                    archived_ids.append(existing_archived_id[0])
-
-        archived_points = len(archived_ids)
-        archived_points_all_files += archived_points
-
-        logging.info(f"Archived {archived_points} points older than {cutoff_time}")
-        logging.debug(f"Archived points IDs: {archived_ids}")
-
-        if archived_points > 0:
-            logging.info(f"Moving fire-forest relations for archived points")
-            for old_id, new_id in zip(points_to_archive, archived_ids):
-                cur.execute("""
-                    INSERT INTO archived_fire_forest_relations (fire_id, forestry_id)
-                    SELECT %s, forestry_id
-                    FROM fire_forest_relations
-                    WHERE fire_id = %s
-                    ON CONFLICT DO NOTHING
-                """, (new_id, old_id[0]))
-            
-            cur.execute("""
-                DELETE FROM fire_forest_relations
-                WHERE fire_id IN %s
-            """, (tuple([point[0] for point in points_to_archive]),))
+    last_id = 0
+    chunk_number = 0
+    archived_total = 0
+    while True:
+        started = time.monotonic()
+        try:
+            create_archive_map(cur)
+            selected = select_archive_chunk(cur, "fires", cutoff_time, last_id, chunk_size)
+            if not selected:
+                conn.commit()
+                break
+
+            cur.execute("SELECT max(old_id) FROM archive_map")
+            last_id = cur.fetchone()[0]
+            inserted_points, archived_points, moved_relations = move_chunk_to_archive(cur, "fires")
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Error archiving old points: {e}")
+            conn.rollback()
+            break
+
+        chunk_number += 1
+        archived_total += archived_points
+        elapsed = time.monotonic() - started
+        logging.info(f"Archive chunk {chunk_number}: {selected} expired, {inserted_points} inserted, "
+                     f"{archived_points - inserted_points} matched existing, {selected - archived_points} unmatched, "
+                     f"{moved_relations} relations moved in {elapsed:.2f}s ({selected / max(elapsed, 1e-6):.0f} rows/s)")
+
+        if selected < chunk_size:
+            break
+
+    logging.info(f"Archived {archived_total} points older than {cutoff_time}")
+    return archived_total
+
+def archive_expired_partitions(cur, conn, cutoff_time, chunk_size=None):
+    # Секции fires, целиком лежащие до отсечки, переносятся пакетно и удаляются без построчного DELETE
+    chunk_size = chunk_size or archive_chunk_size
+    archived_total = 0
+
+    for partition in expired_partitions(cur, "fires", cutoff_time.date()):
+        started = time.monotonic()
+        try:
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS partition_moved (old_id BIGINT PRIMARY KEY)")
+            cur.execute("TRUNCATE partition_moved")
+            last_id = 0
+            moved_points = 0
+            while True:
+                create_archive_map(cur)
+                selected = select_archive_chunk(cur, partition, cutoff_time, last_id, chunk_size, skip_locked=False)
+                if not selected:
+                    break
+                cur.execute("SELECT max(old_id) FROM archive_map")
+                last_id = cur.fetchone()[0]
+                _, archived_points, _ = move_chunk_to_archive(cur, partition, delete_source=False)
+                cur.execute("INSERT INTO partition_moved SELECT old_id FROM archive_map WHERE new_id IS NOT NULL")
+                moved_points += archived_points
 
+            # Секция удаляется целиком, поэтому проверяем каждую ее строку, а не только отобранные по observed_at:
+            # несопоставленные точки и строки, записанные во время переноса, уйдут построчно
+            cur.execute(f"LOCK TABLE {partition} IN SHARE MODE")
+            cur.execute(f"""
+                SELECT count(*) FROM {partition} p
+                WHERE NOT EXISTS (SELECT 1 FROM partition_moved m WHERE m.old_id = p.id)
+            """)
+            remaining_points = cur.fetchone()[0]
+            if remaining_points:
+                logging.warning(f"Partition {partition} has {remaining_points} points not moved to the archive, "
+                                f"keeping it attached")
+                conn.rollback()
+                continue
+
+            detach_partition(cur, "fires", partition)
+            cur.execute(f"DROP TABLE {partition}")
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Error archiving partition {partition}: {e}")
+            conn.rollback()
+            continue
+
+        archived_total += moved_points
+        elapsed = time.monotonic() - started
+        logging.info(f"Archived partition {partition}: {moved_points} points in {elapsed:.2f}s "
+                     f"({moved_points / max(elapsed, 1e-6):.0f} rows/s)")
+    return archived_total
+
+def archive_data(conn=None):
+    archived_points = 0
+
+    # Долгоживущий процесс передает свое соединение; разовый запуск открывает новое
+    own_connection = conn is None
+    if own_connection:
+        conn = psycopg2.connect(cursor_factory=CountingCursor, **db_config)
+    try:
+        with stage_timer("archive"), conn.cursor() as cur:
+            if own_connection:
+                apply_migrations(conn)
             cur.execute("""
-                DELETE FROM fires
-                WHERE id IN %s
-            """, (tuple([point[0] for point in points_to_archive]),))
-    except Exception as e:
-        logging.error(f"Error archiving old points: {e}")
-        cur.execute("ROLLBACK")
-
-def archive_data():
-    global archived_points_all_files
-    archived_points_all_files = 0
-
-    with psycopg2.connect(**db_config) as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT MAX(acq_date + acq_time::interval) FROM fires
-        """)
-        max_acq_datetime = cur.fetchone()[0]
+                SELECT MAX(observed_at) FROM fires
+            """)
+            max_acq_datetime = cur.fetchone()[0]
+            conn.commit()
 
-        if max_acq_datetime:
-            cutoff_time = max_acq_datetime - timedelta(hours=24)
-            archive_old_points(cur, cutoff_time)
+            if max_acq_datetime:
+                cutoff_time = max_acq_datetime - timedelta(hours=24)
+                if is_partitioned(cur, "fires"):
+                    archived_points += archive_expired_partitions(cur, conn, cutoff_time)
+                archived_points += archive_old_points(cur, conn, cutoff_time)
 
-        conn.commit()
+            # Для секционированной схемы заранее создаем секции и применяем срок хранения архива
+            ensure_partitions(cur)
+            apply_archive_retention(cur)
+            conn.commit()
+    finally:
+        if own_connection:
+            conn.close()
+    return archived_points
 
 if __name__ == "__main__":
-    archive_data()
+    with metered_run("archive_data") as totals:
+        totals["points_archived"] = archive_data()
     logging.info('Finished archiving data.')
@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import os
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from pipeline_metrics import add_metrics, metered_run, metric_key, setup_logging, timed
+
+# Настройка логирования
+setup_logging()
+logging.info('Starting backfill script execution.')
+
+from boundary_cache import load_boundary, points_in_boundary
+from fire_merge import merge_feeds
+from firms_csv import iter_firms_csv, take_batch
+from forest_cache import load_forest_cache, save_forest_cache
+from process_data import (boundary_cache_path, create_connection_pool, forest_cache_path, ingest_merged,
+                          log_run_totals, prepare_database, processed_directory)
+
+# Память ограничена размером пачки, а не размером архива
+backfill_chunk_rows = int(os.getenv('BACKFILL_CHUNK_ROWS', '50000'))
+checkpoint_file = "backfill_checkpoint.json"
+# Блокировка конвейера берется на порцию из стольких пачек, а не на весь архив
+lock_chunks = int(os.getenv('BACKFILL_LOCK_CHUNKS', '20'))
+lock_retry_seconds = float(os.getenv('BACKFILL_LOCK_RETRY_SECONDS', '30'))
+
+def load_checkpoint(path):
+    try:
+        return json.loads(Path(path).read_text())
+    except FileNotFoundError:
+        return {}
+
+def save_checkpoint(checkpoint, path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(str(path) + ".tmp")
+    tmp_path.write_text(json.dumps(checkpoint, indent=2, sort_keys=True))
+    os.replace(tmp_path, path)
+
+def find_backfill_files(paths):
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(path.rglob('*.csv')))
+        else:
+            files.append(path)
+    return files
+
+def resume_offset(checkpoint, file_path):
+    # Если файл заменили после прерванного запуска, он читается с начала
+    stat = os.stat(file_path)
+    progress = checkpoint.get(str(file_path))
+    if progress and progress["size"] == stat.st_size and progress["mtime_ns"] == stat.st_mtime_ns:
+        return progress
+    progress = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "offset": 0, "done": False}
+    checkpoint[str(file_path)] = progress
+    return progress
+
+def backfill_file(file_path, satellite, pool, boundary, forest_cache, checkpoint, checkpoint_path, totals,
+                  max_chunks=None):
+    # Возвращает "done", "more" (обработано max_chunks пачек, файл не дочитан) или "failed"
+    progress = resume_offset(checkpoint, file_path)
+    if progress["done"]:
+        logging.info(f"Backfill already finished for {file_path}, skipped")
+        return "done"
+    if progress["offset"]:
+        logging.info(f"Resuming backfill of {file_path} from byte {progress['offset']} of {progress['size']}")
+
+    # Те же этапы, что и в живой обработке: разбор, отсев по границе, слияние, запись частями
+    chunks = iter_firms_csv(file_path, satellite, backfill_chunk_rows, progress["offset"])
+    chunks_done = 0
+    while True:
+        if chunks_done == max_chunks:
+            chunks.close()
+            return "more"
+
+        metrics = Counter()
+        with timed(metrics, "parse"):
+            batch, offset = next(chunks, (None, None))
+        if batch is None:
+            break
+        totals["points_total"] += batch["size"]
+        metrics[metric_key("feed_rows_read", satellite=satellite)] += batch["size"]
+        metrics[metric_key("feed_bytes_read", satellite=satellite)] += offset - progress["offset"]
+        with timed(metrics, "spatial_filter"):
+            inside = points_in_boundary(boundary, batch["latitude"], batch["longitude"])
+        batch = take_batch(batch, np.flatnonzero(inside))
+        metrics[metric_key("feed_rows_inside", satellite=satellite)] += batch["size"]
+        add_metrics(metrics)
+        merged, duplicates = merge_feeds([batch])
+        if merged is not None:
+            totals["duplicates_merged"] += duplicates
+            if not ingest_merged(merged, pool, totals, forest_cache):
+                logging.error(f"Backfill of {file_path} stopped at byte {progress['offset']}, rerun to resume")
+                return "failed"
+        # Смещение сохраняется только после фиксации пачки: повтор пачки после сбоя идемпотентен
+        progress["offset"] = offset
+        save_checkpoint(checkpoint, checkpoint_path)
+        logging.info(f"Backfill {file_path}: {offset} of {progress['size']} bytes", extra={"sample_every": 20})
+        chunks_done += 1
+
+    progress["done"] = True
+    save_checkpoint(checkpoint, checkpoint_path)
+    totals["files_processed"] += 1
+    return "done"
+
+def run_pipeline_pass():
+    # Запуск конвейера, запрошенный во время порции, выполняется сразу после нее под той же блокировкой
+    from dwnld_firms import run_once
+    try:
+        run_once()
+    except Exception as e:
+        logging.error(f"Coalesced pipeline run after a backfill slice failed: {e}")
+
+def run_locked(step):
+    # Загрузка пишет в fires и архивирует, поэтому каждая порция идет под блокировкой конвейера.
+    # Занятая блокировка не оставляет запроса на повтор: порция ждет окончания запуска и пробует снова
+    from run_lock import run_single_flight
+    result = []
+    while not result:
+        run_single_flight(lambda: result.append(step()), "backfill.py", rerun=run_pipeline_pass, coalesce=False)
+        if not result:
+            logging.info(f"Pipeline run in progress, backfill retries in {lock_retry_seconds:g}s")
+            time.sleep(lock_retry_seconds)
+    return result[0]
+
+def backfill_slice(file_path, satellite, pool, boundary, forest_cache, checkpoint, checkpoint_path, totals):
+    # Старые точки переносятся в архив после каждой порции тем же этапом, что и в живой обработке
+    from archive_data import archive_data
+    with metered_run("backfill") as slice_totals:
+        status = backfill_file(file_path, satellite, pool, boundary, forest_cache, checkpoint, checkpoint_path,
+                               slice_totals, lock_chunks)
+        save_forest_cache(forest_cache, forest_cache_path)
+        log_run_totals(slice_totals)
+        if status != "failed":
+            slice_totals["points_archived"] = archive_data()
+    totals.update(slice_totals)
+    return status
+
+def backfill(satellite, paths, restart=False):
+    checkpoint_path = Path(processed_directory) / checkpoint_file
+    checkpoint = {} if restart else load_checkpoint(checkpoint_path)
+    totals = Counter()
+    pool = create_connection_pool()
+    forest_cache = None
+    try:
+        conn = pool.getconn()
+        try:
+            prepare_database(conn)
+            with conn.cursor() as cur:
+                boundary = load_boundary(cur, boundary_cache_path)
+                forest_cache = load_forest_cache(cur, forest_cache_path)
+            conn.commit()
+        finally:
+            pool.putconn(conn)
+
+        for file_path in find_backfill_files(paths):
+            status = "more"
+            while status == "more":
+                status = run_locked(lambda: backfill_slice(file_path, satellite, pool, boundary, forest_cache,
+                                                           checkpoint, checkpoint_path, totals))
+            if status == "failed":
+                totals["files_failed"] += 1
+                break
+    finally:
+        if forest_cache is not None:
+            save_forest_cache(forest_cache, forest_cache_path)
+        pool.closeall()
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковая загрузка архивных CSV FIRMS")
+    parser.add_argument("satellite", help="Имя источника, как у каталогов в DownloadedData (например, MODIS_C6)")
+    parser.add_argument("paths", nargs="+", help="CSV-файлы или каталоги с ними")
+    parser.add_argument("--restart", action="store_true", help="Игнорировать сохраненный прогресс")
+    args = parser.parse_args()
+
+    totals = backfill(args.satellite, args.paths, args.restart)
+    logging.info(f"Backfill finished: {totals['files_processed']} file(s) processed, "
+                 f"{totals['files_failed']} failed, {totals['points_archived']} points archived")
+
+if __name__ == "__main__":
+    main()
+
+logging.info('Finished backfill script execution.')
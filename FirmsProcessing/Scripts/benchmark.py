@@ -0,0 +1,261 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pipeline_metrics
+from synthetic_firms import bench_boundary, forest_squares, generate_feeds
+
+# Минимальная схема тестовой базы: те же таблицы, что и в рабочей, со своей границей и лесами.
+# Колонки observed_at и satellites добавляют миграции при первом запуске обработки
+fire_columns = """
+    id SERIAL PRIMARY KEY, latitude DOUBLE PRECISION, longitude DOUBLE PRECISION, brightness DOUBLE PRECISION,
+    scan DOUBLE PRECISION, track DOUBLE PRECISION, acq_date DATE, acq_time TIME, local_time TIME,
+    satellite TEXT, confidence TEXT, version TEXT, bright_t31 DOUBLE PRECISION, frp DOUBLE PRECISION,
+    daynight TEXT, geom geometry(Point, 4326)
+"""
+bench_schema = f"""
+    CREATE EXTENSION IF NOT EXISTS postgis;
+    CREATE TABLE IF NOT EXISTS boundaries (id SERIAL PRIMARY KEY, geom geometry(MultiPolygon, 4326));
+    CREATE TABLE IF NOT EXISTS forestry_geometries (forestry_id INTEGER, geom geometry(MultiPolygon, 4326));
+    CREATE TABLE IF NOT EXISTS fires ({fire_columns});
+    CREATE TABLE IF NOT EXISTS archived_fires ({fire_columns});
+    CREATE TABLE IF NOT EXISTS fire_forest_relations (fire_id INTEGER, forestry_id INTEGER);
+    CREATE TABLE IF NOT EXISTS archived_fire_forest_relations (fire_id INTEGER, forestry_id INTEGER);
+"""
+migrations_directory = Path(__file__).resolve().parent.parent / "Migrations"
+bench_tables = ("fires", "archived_fires", "fire_forest_relations", "archived_fire_forest_relations",
+                "fire_daily_aggregates")
+
+class QuietRequestHandler(SimpleHTTPRequestHandler):
+    # Локальная замена сервера FIRMS; отдает Last-Modified и отвечает 304 на If-Modified-Since
+    def log_message(self, format, *args):
+        pass
+
+def start_feed_server(directory):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietRequestHandler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def bench_db_config():
+    # Отдельные переменные, чтобы тест случайно не очистил рабочую базу из DB_NAME
+    if not os.getenv('BENCH_DB_NAME'):
+        sys.exit("BENCH_DB_NAME is not set: point the benchmark at a disposable PostGIS database")
+    return {
+        "host": os.getenv('BENCH_DB_HOST', 'localhost'),
+        "dbname": os.getenv('BENCH_DB_NAME'),
+        "user": os.getenv('BENCH_DB_USER'),
+        "password": os.getenv('BENCH_DB_PASSWORD'),
+    }
+
+def prepare_bench_database(conn, forests):
+    min_lon, min_lat, max_lon, max_lat = bench_boundary
+    with conn.cursor() as cur:
+        cur.execute(bench_schema)
+        cur.execute("TRUNCATE boundaries, forestry_geometries")
+        cur.execute("INSERT INTO boundaries (geom) VALUES (ST_Multi(ST_MakeEnvelope(%s, %s, %s, %s, 4326)))",
+                    (min_lon, min_lat, max_lon, max_lat))
+        cur.execute("""
+            INSERT INTO forestry_geometries (forestry_id, geom)
+            SELECT forestry_id, ST_Multi(ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, 4326))
+            FROM unnest(%s::int[], %s::float8[], %s::float8[], %s::float8[], %s::float8[])
+                AS s(forestry_id, min_lon, min_lat, max_lon, max_lat)
+        """, [list(column) for column in zip(*forest_squares(forests))])
+    conn.commit()
+    # Миграции из репозитория: вне контейнера путь /app/FirmsProcessing/Migrations не существует
+    from db_migrations import apply_migrations
+    apply_migrations(conn, migrations_directory)
+
+def reset_bench_state(conn, workdir):
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(bench_tables)} RESTART IDENTITY")
+    conn.commit()
+    for name in ("DownloadedData", "ProcessedData", "Cache"):
+        shutil.rmtree(workdir / name, ignore_errors=True)
+
+def run_stage(name, stage):
+    # Этап выполняется в отдельном процессе: пик памяти ru_maxrss относится только к нему и его обработчикам
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+
+    def target():
+        try:
+            pipeline_metrics.start_run(f"benchmark_{name}")
+            started = time.perf_counter()
+            rows, details = stage()
+            seconds = time.perf_counter() - started
+            peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            # Таймеры этапов и число обращений к БД из слоя метрик самого конвейера
+            record = pipeline_metrics.finish_run()
+            sender.send({"seconds": seconds, "rows": rows, "peak_rss_mb": peak_kb / 1024, "details": details,
+                         "metrics": record["metrics"]})
+        except Exception as e:
+            sender.send({"error": f"{type(e).__name__}: {e}"})
+
+    process = multiprocessing.get_context('fork').Process(target=target, name=f"bench-{name}")
+    process.start()
+    result = receiver.recv()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(f"Benchmark stage {name} failed: {result['error']}")
+    logging.info(f"{name}: {result['rows']} rows in {result['seconds']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    return result
+
+def summarize_stage(runs):
+    seconds = [run["seconds"] for run in runs]
+    median = statistics.median(seconds)
+    rows = runs[-1]["rows"]
+    return {
+        "rows": rows,
+        "median_seconds": round(median, 4),
+        "min_seconds": round(min(seconds), 4),
+        "max_seconds": round(max(seconds), 4),
+        "rows_per_second": round(rows / median, 1) if median else None,
+        "peak_rss_mb": round(max(run["peak_rss_mb"] for run in runs), 1),
+        "details": runs[-1]["details"],
+        "metrics": runs[-1]["metrics"],
+    }
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmark(args):
+    db_config = bench_db_config()
+    # Модули конвейера читают DB_* при импорте, поэтому переменные выставляются до импорта
+    os.environ.update({"DB_HOST": db_config["host"], "DB_NAME": db_config["dbname"],
+                       "DB_USER": db_config["user"] or "", "DB_PASSWORD": db_config["password"] or ""})
+    import psycopg2
+
+    import archive_data
+    import dwnld_firms
+    import process_data
+
+    workdir = Path(args.workdir)
+    served_directory = workdir / "served"
+    download_directory = workdir / "DownloadedData"
+    process_data.processed_directory = str(workdir / "ProcessedData")
+    process_data.boundary_cache_path = str(workdir / "Cache" / "boundary.npz")
+    process_data.forest_cache_path = str(workdir / "Cache" / "forest_cells.npz")
+    pipeline_metrics.metrics_directory = workdir / "Metrics"
+    pipeline_metrics.prometheus_textfile = workdir / "Metrics" / "firms_pipeline.prom"
+
+    shutil.rmtree(served_directory, ignore_errors=True)
+    files = generate_feeds(served_directory, dwnld_firms.urls, args.rows, args.inside_share, args.overlap,
+                           args.repeat_rate, args.days, seed=args.seed)
+    feed_bytes = sum(path.stat().st_size for path in files.values())
+    generated_rows = args.rows * len(files)
+    server = start_feed_server(served_directory)
+    feed_urls = {satellite: f"http://127.0.0.1:{server.server_port}/{path.relative_to(served_directory).as_posix()}"
+                 for satellite, path in files.items()}
+
+    def download():
+        changed = dwnld_firms.download_data(feeds=feed_urls, directory=download_directory)
+        return generated_rows, {"changed_feeds": len(changed), "bytes": feed_bytes}
+
+    def process():
+        totals = process_data.process_data(directory=download_directory, workers=args.workers or None)
+        return totals["points_total"], dict(totals)
+
+    def archive():
+        return archive_data.archive_data(), {}
+
+    stages = {"download": [], "download_unchanged": [], "process": [], "archive": []}
+    conn = psycopg2.connect(**db_config)
+    try:
+        prepare_bench_database(conn, args.forests)
+        for repeat in range(args.repeats):
+            logging.info(f"Benchmark repeat {repeat + 1} of {args.repeats}")
+            reset_bench_state(conn, workdir)
+            stages["download"].append(run_stage("download", download))
+            # Повторное скачивание без изменений: условные запросы и ответ 304
+            stages["download_unchanged"].append(run_stage("download_unchanged", download))
+            stages["process"].append(run_stage("process", process))
+            stages["archive"].append(run_stage("archive", archive))
+    finally:
+        conn.close()
+        server.shutdown()
+
+    record = {
+        "timestamp": datetime.utcnow().isoformat(timespec='seconds'),
+        "commit": current_commit(),
+        "label": args.label,
+        "params": {"rows": args.rows, "inside_share": args.inside_share, "overlap": args.overlap,
+                   "repeat_rate": args.repeat_rate, "days": args.days, "forests": args.forests,
+                   "repeats": args.repeats, "workers": args.workers, "seed": args.seed},
+        "stages": {name: summarize_stage(runs) for name, runs in stages.items()},
+    }
+    with open(args.results, 'a') as file:
+        file.write(json.dumps(record, sort_keys=True) + "\n")
+    print_records([record])
+    return record
+
+def print_records(records):
+    baseline = records[0]["stages"]
+    for record in records:
+        print(f"{record['timestamp']}  {record.get('commit') or '-'}  {record.get('label') or ''}")
+        for name, stage in record["stages"].items():
+            base = baseline.get(name, {}).get("rows_per_second")
+            change = (f"{stage['rows_per_second'] / base - 1:+.1%}"
+                      if base and stage["rows_per_second"] and record is not records[0] else "")
+            print(f"  {name:<20} {stage['rows']:>10} rows  {stage['median_seconds']:>9.3f}s  "
+                  f"{stage['rows_per_second'] or 0:>12.1f} rows/s  {stage['peak_rss_mb']:>8.1f} MB  {change}")
+
+def compare_results(args):
+    with open(args.results) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    if args.commits:
+        records = [record for record in records if record.get("commit") in args.commits]
+    records = records[-args.last:]
+    if not records:
+        sys.exit(f"No benchmark records in {args.results}")
+    # Первая запись — база, для остальных печатается изменение пропускной способности
+    print_records(records)
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест конвейера на синтетических данных FIRMS")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Сгенерировать данные, прогнать этапы и дописать результат")
+    run.add_argument("--rows", type=int, default=50000, help="Строк в каждом из четырех источников")
+    run.add_argument("--inside-share", type=float, default=0.3, help="Доля точек внутри границы")
+    run.add_argument("--overlap", type=float, default=0.2, help="Доля наблюдений, общих для всех спутников")
+    run.add_argument("--repeat-rate", type=float, default=0.3, help="Доля строк с уже встречавшимся пикселем")
+    run.add_argument("--days", type=int, default=3, help="За сколько дней распределены наблюдения")
+    run.add_argument("--forests", type=int, default=400, help="Число синтетических лесов внутри границы")
+    run.add_argument("--repeats", type=int, default=3, help="Сколько раз прогнать каждый этап")
+    run.add_argument("--workers", type=int, default=0, help="FIRMS_WORKERS для этапа обработки (0 — по числу ядер)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--label", default="", help="Пометка записи, например имя ветки")
+    run.add_argument("--workdir", default="/tmp/firms_benchmark")
+    run.add_argument("--results", default="benchmark_results.jsonl")
+
+    compare = commands.add_parser("compare", help="Сравнить записанные результаты")
+    compare.add_argument("--results", default="benchmark_results.jsonl")
+    compare.add_argument("--last", type=int, default=5, help="Сколько последних записей показать")
+    compare.add_argument("commits", nargs="*", help="Показать только эти коммиты")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    if args.command == "run":
+        run_benchmark(args)
+    else:
+        compare_results(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+# Сколько пар "точка x ребро" проверяется за один шаг, чтобы не раздувать память
+points_x_edges_per_step = 1_000_000
+
+def table_fingerprint(cur, table):
+    # Отпечаток содержимого геометрий: меняется при любой правке таблицы в БД. Читает всю таблицу,
+    # поэтому нужен только для сверки кэша на диске при запуске
+    cur.execute(f"""
+        SELECT count(*), md5(coalesce(string_agg(digest, '' ORDER BY digest), ''))
+        FROM (SELECT md5(ST_AsBinary(geom)) AS digest FROM {table}) geometries
+    """)
+    count, digest = cur.fetchone()
+    return f"{count}:{digest}"
+
+def table_version(cur, table):
+    # Счетчик из table_versions, который триггер увеличивает при каждом изменении таблицы
+    cur.execute("SELECT version FROM table_versions WHERE table_name = %s", (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def save_npz_atomically(path, **arrays):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_path, path)
+
+def polygon_rings(geojson):
+    geometry = json.loads(geojson)
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return []
+    return [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
+
+def build_boundary(row_rings, fingerprint):
+    # Кольца одной строки boundaries (включая дыры) обрабатываются по правилу чет-нечет; точка внутри,
+    # если она внутри хотя бы одной строки, как в EXISTS ... ST_Contains. Ребра строки лежат подряд
+    # и начинаются с row_starts
+    edges = []
+    row_starts = []
+    edge_count = 0
+    for rings in row_rings:
+        row_edges = [np.hstack([ring[:-1], ring[1:]]) for ring in rings if len(ring) > 1]
+        if not row_edges:
+            continue
+        row_starts.append(edge_count)
+        edges.extend(row_edges)
+        edge_count += sum(len(ring_edges) for ring_edges in row_edges)
+    edges = np.vstack(edges) if edges else np.empty((0, 4))
+    if len(edges):
+        bbox = np.array([edges[:, 0].min(), edges[:, 1].min(), edges[:, 0].max(), edges[:, 1].max()])
+    else:
+        bbox = np.array([np.inf, np.inf, -np.inf, -np.inf])
+    return {"fingerprint": fingerprint, "edges": edges, "row_starts": np.array(row_starts, dtype=np.int64),
+            "bbox": bbox}
+
+def load_boundary(cur, cache_path):
+    fingerprint = table_fingerprint(cur, "boundaries")
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if str(cached["fingerprint"]) == fingerprint:
+                    logging.info(f"Boundary geometry loaded from cache {cache_path}")
+                    return {"fingerprint": fingerprint, "edges": cached["edges"], "row_starts": cached["row_starts"],
+                            "bbox": cached["bbox"]}
+            logging.info("Boundary geometry changed in the database, rebuilding cache")
+        except Exception as e:
+            logging.warning(f"Failed to read boundary cache {cache_path}: {e}")
+
+    cur.execute("SELECT ST_AsGeoJSON(geom) FROM boundaries")
+    row_rings = [polygon_rings(geojson) for (geojson,) in cur.fetchall()]
+    boundary = build_boundary(row_rings, fingerprint)
+    save_npz_atomically(cache_path, fingerprint=np.array(fingerprint), edges=boundary["edges"],
+                        row_starts=boundary["row_starts"], bbox=boundary["bbox"])
+    logging.info(f"Boundary geometry cached to {cache_path}: {len(row_rings)} rows, "
+                 f"{sum(len(rings) for rings in row_rings)} rings, {len(boundary['edges'])} edges")
+    return boundary
+
+def points_in_boundary(boundary, lat, lon):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    inside = np.zeros(len(lat), dtype=bool)
+
+    # Сначала дешевая проверка по охватывающему прямоугольнику
+    min_lon, min_lat, max_lon, max_lat = boundary["bbox"]
+    candidates = np.flatnonzero((lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat))
+    edges = boundary["edges"]
+    if not len(candidates) or not len(edges):
+        return inside
+
+    # Точная проверка лучом: считаем пересечения ребер горизонтальным лучом вправо от точки
+    x1, y1, x2, y2 = (edges[:, i] for i in range(4))
+    step = max(1, points_x_edges_per_step // len(edges))
+    for start in range(0, len(candidates), step):
+        index = candidates[start:start + step]
+        px = lon[index, None]
+        py = lat[index, None]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        # Четность пересечений считается по каждой строке отдельно, затем строки объединяются
+        hits = np.add.reduceat((crosses & (px < x_cross)).astype(np.int64), boundary["row_starts"], axis=1)
+        inside[index] = np.any(hits % 2 == 1, axis=1)
+    return inside
@@ -0,0 +1,50 @@
+import os
+import logging
+from pathlib import Path
+
+import psycopg2
+
+from fire_aggregates import fill_aggregates
+
+migrations_directory = "/app/FirmsProcessing/Migrations"
+
+db_config = {
+    "host": os.getenv('DB_HOST', 'localhost'),
+    "dbname": os.getenv('DB_NAME'),
+    "user": os.getenv('DB_USER'),
+    "password": os.getenv('DB_PASSWORD')
+}
+
+# Заполнение данных после миграции, которое уже есть в коде скриптов; выполняется в транзакции миграции
+post_migration_steps = {
+    "003_fire_daily_aggregates": fill_aggregates,
+}
+
+def apply_migrations(conn, directory=migrations_directory):
+    with conn.cursor() as cur:
+        # Блокировка не дает двум скриптам применять одну и ту же миграцию одновременно
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('firms_schema_migrations'))")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+
+        for path in sorted(Path(directory).glob("*.sql")):
+            if path.stem in applied:
+                continue
+            logging.info(f"Applying migration {path.name}")
+            cur.execute(path.read_text(encoding='utf-8'))
+            if path.stem in post_migration_steps:
+                post_migration_steps[path.stem](cur)
+            cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (path.stem,))
+            logging.info(f"Migration {path.name} applied")
+    conn.commit()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename='/var/log/app.log')
+    with psycopg2.connect(**db_config) as conn:
+        apply_migrations(conn)
@@ -1,16 +1,28 @@
-import subprocess
-import sys
+import hashlib
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlparse
 import logging
 import os
 
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline_metrics import count, metered_run, setup_logging, stage_timer
+
 # Настройка логирования
 log_file = "/var/log/app.log"
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename=log_file)
+setup_logging(log_file)
 logging.info('Starting download_firms_data script execution.')
 
 # Путь к директории для скачивания данных внутри Docker контейнера
 base_download_directory = Path("/app/FirmsProcessing/DownloadedData")
+# ETag / Last-Modified и хэши последних скачанных файлов для условных запросов
+download_state_file = "download_state.json"
 
 token = os.getenv('FIRMS_API_TOKEN')
 if not token:
@@ -23,37 +35,172 @@ urls = {
     "NOAA_21_VIIRS_C2": "https://firms.modaps.eosdis.nasa.gov/data/active_fire/noaa-21-viirs-c2/csv/J2_VIIRS_C2_Russia_Asia_24h.csv"
 }
 
-def download_data():
+request_timeout = int(os.getenv('DOWNLOAD_TIMEOUT_SECONDS', '120'))
+max_attempts = int(os.getenv('DOWNLOAD_MAX_ATTEMPTS', '4'))
+backoff_seconds = float(os.getenv('DOWNLOAD_BACKOFF_SECONDS', '2'))
+retry_statuses = {429, 500, 502, 503, 504}
+
+class RetryableDownloadError(Exception):
+    pass
+
+def create_session(pool_size):
+    # Одна сессия с пулом соединений на все потоки скачивания
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+    return session
+
+def load_download_state(directory):
+    path = directory / download_state_file
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text())
+    except ValueError as e:
+        logging.warning(f"Download state {path} is corrupted, starting from scratch: {e}")
+        return {}
+
+def save_download_state(directory, state):
+    path = directory / download_state_file
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+    os.replace(tmp_path, path)
+
+def write_response_atomically(response, target):
+    # Файл появляется под своим именем только целиком, обработка никогда не увидит его наполовину
+    digest = hashlib.sha256()
+    file_descriptor, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".part")
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                digest.update(chunk)
+                file.write(chunk)
+        return tmp_name, digest.hexdigest()
+    except Exception:
+        os.unlink(tmp_name)
+        raise
+
+def download_feed(session, satellite, url, directory, feed_state):
+    satellite_directory = directory / satellite
+    satellite_directory.mkdir(parents=True, exist_ok=True)
+    target = satellite_directory / Path(urlparse(url).path).name
+
+    headers = {}
+    if target.exists():
+        if feed_state.get("etag"):
+            headers["If-None-Match"] = feed_state["etag"]
+        if feed_state.get("last_modified"):
+            headers["If-Modified-Since"] = feed_state["last_modified"]
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with session.get(url, headers=headers, timeout=request_timeout, stream=True) as response:
+                if response.status_code == 304:
+                    logging.info(f"{satellite}: not modified since last download.")
+                    count("feed_downloads", satellite=satellite, result="not_modified")
+                    return False, feed_state
+                if response.status_code in retry_statuses:
+                    raise RetryableDownloadError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+
+                tmp_name, sha256 = write_response_atomically(response, target)
+                count("feed_bytes_downloaded", os.path.getsize(tmp_name), satellite=satellite)
+                new_state = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "sha256": sha256,
+                    "downloaded_at": datetime.utcnow().isoformat(timespec='seconds'),
+                }
+            # Сервер мог вернуть тот же файл без поддержки условных запросов
+            if sha256 == feed_state.get("sha256") and target.exists():
+                os.unlink(tmp_name)
+                logging.info(f"{satellite}: downloaded content is unchanged.")
+                count("feed_downloads", satellite=satellite, result="unchanged")
+                return False, new_state
+            os.replace(tmp_name, target)
+            logging.info(f"{satellite}: saved new data to {target}.")
+            count("feed_downloads", satellite=satellite, result="changed")
+            return True, new_state
+        # ChunkedEncodingError — соединение оборвалось посреди тела ответа
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                RetryableDownloadError) as e:
+            count("feed_download_retries", satellite=satellite)
+            if attempt == max_attempts:
+                raise
+            delay = backoff_seconds * 2 ** (attempt - 1)
+            logging.warning(f"{satellite}: attempt {attempt} failed ({e}), retrying in {delay:.0f}s.")
+            time.sleep(delay)
+
+def download_data(feeds=None, directory=None, session=None):
+    feeds = feeds or urls
+    directory = Path(directory or base_download_directory)
     logging.info("Начало процесса скачивания данных.")
+
+    # Проверка наличия базовой директории для загрузки
+    if not directory.exists():
+        logging.info(f"Создание базовой директории для загрузки данных: {directory}")
+        directory.mkdir(parents=True, exist_ok=True)
+
+    state = load_download_state(directory)
+    own_session = session is None
+    if own_session:
+        session = create_session(len(feeds))
     try:
-        # Проверка наличия базовой директории для загрузки
-        if not base_download_directory.exists():
-            logging.info(f"Создание базовой директории для загрузки данных: {base_download_directory}")
-            base_download_directory.mkdir(parents=True, exist_ok=True)
-        
-        for satellite, url in urls.items():
-            satellite_directory = base_download_directory / satellite
-            if not satellite_directory.exists():
-                logging.info(f"Создание директории для {satellite}: {satellite_directory}")
-                satellite_directory.mkdir(parents=True, exist_ok=True)
-            
-            logging.info(f"Запуск процесса wget для скачивания данных с {url}.")
-            subprocess.run([
-                "wget", "-e", "robots=off", "-m", "-np", "-R", ".html,.tmp", "-nH", "--cut-dirs=4",
-                url, "--header", f"Authorization: Bearer {token}", "-P", str(satellite_directory)],
-                check=True)
-        
-        logging.info("Скачивание завершено успешно.")
-        
-        logging.info("Запуск process_data.py для обработки данных.")
-        subprocess.run(["/usr/local/bin/python3", "/app/FirmsProcessing/Scripts/process_data.py"], check=True)
+        with stage_timer("download"):
+            changed_feeds = collect_downloads(session, feeds, directory, state)
+    finally:
+        if own_session:
+            session.close()
+
+    state["last_run"] = {"finished_at": datetime.utcnow().isoformat(timespec='seconds'), "changed_feeds": changed_feeds}
+    save_download_state(directory, state)
+    logging.info(f"Скачивание завершено. Обновленные источники: {changed_feeds or 'нет'}.")
+    return changed_feeds
+
+def collect_downloads(session, feeds, directory, state):
+    changed_feeds = []
+    with ThreadPoolExecutor(max_workers=len(feeds)) as executor:
+        futures = {
+            satellite: executor.submit(download_feed, session, satellite, url, directory, state.get(satellite, {}))
+            for satellite, url in feeds.items()
+        }
+        for satellite, future in futures.items():
+            try:
+                changed, state[satellite] = future.result()
+            except Exception as e:
+                logging.error(f"Ошибка при скачивании {satellite}: {e}")
+                continue
+            if changed:
+                changed_feeds.append(satellite)
+    return changed_feeds
+
+def run_once():
+    with metered_run("dwnld_firms") as totals:
+        changed_feeds = download_data()
+        totals["feeds_changed"] = len(changed_feeds)
+
+        # Обработка запускается и без новых файлов: она повторит строки, не записанные прошлым запуском
+        from archive_data import archive_data
+        from process_data import log_run_totals, process_data
+
+        logging.info("Запуск обработки данных.")
+        totals.update(process_data())
+        log_run_totals(totals)
+        totals["points_archived"] = archive_data()
         logging.info("Обработка данных завершена успешно.")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Ошибка при скачивании файлов или обработке данных: {e}")
+
+def main():
+    # Разовый запуск всей цепочки: скачивание, обработка и архивирование в одном процессе
+    from run_lock import run_single_flight
+    try:
+        run_single_flight(run_once, "dwnld_firms.py")
     except Exception as e:
         logging.error(f"Произошла ошибка: {e}")
 
 if __name__ == "__main__":
-    download_data()
+    main()
 
 logging.info('Finished download_firms_data script execution.')
@@ -0,0 +1,164 @@
+import argparse
+import logging
+import os
+from datetime import date
+
+import psycopg2
+
+from run_lock import db_lock_name
+
+db_config = {
+    "host": os.getenv('DB_HOST', 'localhost'),
+    "dbname": os.getenv('DB_NAME'),
+    "user": os.getenv('DB_USER'),
+    "password": os.getenv('DB_PASSWORD')
+}
+
+aggregate_columns = ("forestry_id", "acq_date", "fire_count", "day_count", "night_count",
+                     "max_frp", "max_brightness", "satellites")
+
+point_satellites = "coalesce(f.satellites, string_to_array(f.satellite, ','))"
+
+# Объединение массивов спутников без повторов
+merged_satellites = "ARRAY(SELECT DISTINCT name FROM unnest(a.satellites || {other}) AS name ORDER BY name)"
+
+def aggregate_points_query(points):
+    # points — выборка (forestry_id, acq_date, daynight, frp, brightness, satellites, counted), по строке на связь
+    # точки с лесом; точка с counted = FALSE уже учтена и добавляет в сводку только свои спутники
+    return f"""
+        WITH points AS ({points}),
+        point_satellites AS (
+            SELECT p.forestry_id, p.acq_date, array_agg(DISTINCT s ORDER BY s) AS satellites
+            FROM points p, unnest(p.satellites) AS s
+            GROUP BY p.forestry_id, p.acq_date
+        )
+        SELECT p.forestry_id, p.acq_date, count(*) FILTER (WHERE p.counted),
+               count(*) FILTER (WHERE p.counted AND p.daynight = 'D'),
+               count(*) FILTER (WHERE p.counted AND p.daynight = 'N'),
+               max(p.frp) FILTER (WHERE p.counted), max(p.brightness) FILTER (WHERE p.counted),
+               coalesce(min(s.satellites), '{{}}')
+        FROM points p
+        LEFT JOIN point_satellites s ON s.forestry_id = p.forestry_id AND s.acq_date = p.acq_date
+        GROUP BY p.forestry_id, p.acq_date
+        -- Параллельные части пачки блокируют строки сводки в одном порядке и не ждут друг друга по кругу
+        ORDER BY p.forestry_id, p.acq_date
+    """
+
+def relation_points(fires_table, relations_table, condition="TRUE", counted="TRUE"):
+    return f"""
+        SELECT r.forestry_id, f.acq_date, f.daynight, f.frp, f.brightness, {point_satellites} AS satellites,
+               {counted} AS counted
+        FROM {relations_table} r
+        JOIN {fires_table} f ON f.id = r.fire_id
+        WHERE {condition}
+    """
+
+def update_aggregates(cur, new_ids, updated_ids):
+    # Одна упорядоченная запись на часть пачки, в ее транзакции: новые точки добавляются в счетчики,
+    # уже учтенные точки, которые увидел еще один спутник, дописывают только спутники
+    if not new_ids and not updated_ids:
+        return 0
+    points = relation_points("fires", "fire_forest_relations", "f.id = ANY(%(fire_ids)s)",
+                             counted="f.id = ANY(%(new_ids)s)")
+    cur.execute(f"""
+        INSERT INTO fire_daily_aggregates AS a ({', '.join(aggregate_columns)})
+        {aggregate_points_query(points)}
+        ON CONFLICT (forestry_id, acq_date) DO UPDATE
+        SET fire_count = a.fire_count + EXCLUDED.fire_count,
+            day_count = a.day_count + EXCLUDED.day_count,
+            night_count = a.night_count + EXCLUDED.night_count,
+            max_frp = GREATEST(a.max_frp, EXCLUDED.max_frp),
+            max_brightness = GREATEST(a.max_brightness, EXCLUDED.max_brightness),
+            satellites = {merged_satellites.format(other="EXCLUDED.satellites")},
+            updated_at = NOW()
+    """, {"fire_ids": list(new_ids) + list(updated_ids), "new_ids": list(new_ids)})
+    return cur.rowcount
+
+def subtract_archive_duplicates(cur, source_table):
+    # Вызывается после переноса связей порции и до их удаления из fires. Сводка теряет все связи порции
+    # и получает связи, которые перенос действительно записал в архив (archive_moved_relations): связь,
+    # уже бывшая у совпавшей архивной записи, не добавляется, и точка иначе считалась бы дважды
+    cur.execute(f"""
+        UPDATE fire_daily_aggregates a
+        SET fire_count = a.fire_count - d.surplus,
+            day_count = a.day_count - d.day_surplus,
+            night_count = a.night_count - d.night_surplus,
+            updated_at = NOW()
+        FROM (
+            SELECT forestry_id, acq_date, sum(delta) AS surplus,
+                   coalesce(sum(delta) FILTER (WHERE daynight = 'D'), 0) AS day_surplus,
+                   coalesce(sum(delta) FILTER (WHERE daynight = 'N'), 0) AS night_surplus
+            FROM (
+                SELECT r.forestry_id, f.acq_date, f.daynight, 1 AS delta
+                FROM archive_map m
+                JOIN fire_forest_relations r ON r.fire_id = m.old_id
+                JOIN {source_table} f ON f.id = m.old_id
+                WHERE m.new_id IS NOT NULL
+                UNION ALL
+                SELECT mr.forestry_id, af.acq_date, af.daynight, -1
+                FROM archive_moved_relations mr
+                JOIN archived_fires af ON af.id = mr.fire_id
+            ) changes
+            GROUP BY forestry_id, acq_date
+        ) d
+        WHERE a.forestry_id = d.forestry_id AND a.acq_date = d.acq_date
+          AND (d.surplus <> 0 OR d.day_surplus <> 0 OR d.night_surplus <> 0)
+    """)
+    return cur.rowcount
+
+def fill_aggregates(cur, start_date=None, end_date=None):
+    # Замена строк диапазона дат пересчетом из fires и архива; без дат — вся сводка
+    condition = "TRUE"
+    params = {"start_date": start_date, "end_date": end_date}
+    if start_date:
+        condition += " AND f.acq_date >= %(start_date)s"
+    if end_date:
+        condition += " AND f.acq_date <= %(end_date)s"
+    points = (relation_points("fires", "fire_forest_relations", condition) + " UNION ALL "
+              + relation_points("archived_fires", "archived_fire_forest_relations", condition))
+
+    cur.execute(f"DELETE FROM fire_daily_aggregates f WHERE {condition}", params)
+    deleted = cur.rowcount
+    cur.execute(f"""
+        INSERT INTO fire_daily_aggregates ({', '.join(aggregate_columns)})
+        {aggregate_points_query(points)}
+    """, params)
+    logging.info(f"Rebuilt fire_daily_aggregates: {deleted} rows removed, {cur.rowcount} rows written")
+    return cur.rowcount
+
+def rebuild_aggregates(conn, start_date=None, end_date=None):
+    # Запуски конвейера на время пересчета ждут общей блокировки
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (db_lock_name,))
+        rebuilt = fill_aggregates(cur, start_date, end_date)
+    conn.commit()
+    return rebuilt
+
+def daily_fire_counts(cur, start_date, end_date, forestry_ids=None):
+    # Чтение для дашбордов затрагивает только сводную таблицу
+    condition = "acq_date BETWEEN %s AND %s"
+    params = [start_date, end_date]
+    if forestry_ids is not None:
+        condition += " AND forestry_id = ANY(%s)"
+        params.append(list(forestry_ids))
+    cur.execute(f"""
+        SELECT {', '.join(aggregate_columns)}
+        FROM fire_daily_aggregates
+        WHERE {condition}
+        ORDER BY acq_date, forestry_id
+    """, params)
+    return [dict(zip(aggregate_columns, row)) for row in cur.fetchall()]
+
+if __name__ == "__main__":
+    from pipeline_metrics import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Сводка пожаров по лесничествам и дням")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subcommands.add_parser("rebuild", help="пересчитать сводку из fires и archived_fires")
+    rebuild_parser.add_argument("--from", dest="start_date", type=date.fromisoformat)
+    rebuild_parser.add_argument("--to", dest="end_date", type=date.fromisoformat)
+    args = parser.parse_args()
+
+    with psycopg2.connect(**db_config) as conn:
+        rebuild_aggregates(conn, args.start_date, args.end_date)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from firms_csv import categorical_columns, take_batch
+
+def concat_batches(batches):
+    merged = {"satellite": np.concatenate([np.full(batch["size"], batch["satellite"]) for batch in batches]),
+              "size": sum(batch["size"] for batch in batches)}
+    for column, values in batches[0].items():
+        if column in categorical_columns:
+            # Категории у файлов разные, поэтому сначала возвращаемся к значениям
+            values = np.concatenate([batch[column][0][batch[column][1]] for batch in batches])
+            categories, codes = np.unique(values, return_inverse=True)
+            merged[column] = (categories, codes.reshape(-1))
+        elif isinstance(values, np.ndarray):
+            merged[column] = np.concatenate([batch[column] for batch in batches])
+    return merged
+
+def observation_keys(batch):
+    # Ключ точки (lat, lon, acq_date, acq_time); координаты FIRMS даны с точностью 1e-5
+    keys = np.empty(batch["size"], dtype=[("lat", np.int64), ("lon", np.int64), ("observed", np.int64)])
+    keys["lat"] = np.round(batch["latitude"] * 1e5)
+    keys["lon"] = np.round(batch["longitude"] * 1e5)
+    keys["observed"] = batch["observed"].astype(np.int64)
+    return keys
+
+def merge_feeds(batches):
+    # Каждая точка уходит в БД один раз с итоговым набором спутников
+    batches = sorted((batch for batch in batches if batch["size"]), key=lambda batch: batch["satellite"])
+    if not batches:
+        return None, 0
+    satellites = sorted({batch["satellite"] for batch in batches})
+    combined = concat_batches(batches)
+
+    bits = np.left_shift(1, np.searchsorted(np.array(satellites), combined["satellite"])).astype(np.int64)
+    # Первое вхождение ключа (по отсортированному имени спутника) дает атрибуты точки — порядок детерминирован
+    _, first_rows, groups = np.unique(observation_keys(combined), return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+    masks = np.zeros(len(first_rows), dtype=np.int64)
+    np.bitwise_or.at(masks, groups, bits)
+
+    merged = take_batch(combined, first_rows)
+    labels = {mask: ",".join(name for bit, name in enumerate(satellites) if mask >> bit & 1)
+              for mask in np.unique(masks).tolist()}
+    merged["satellite"] = np.array([labels[mask] for mask in masks.tolist()])
+    merged["satellite_mask"] = masks
+    return merged, combined["size"] - merged["size"]
+
+def shard_batch(batch, shard_count):
+    if shard_count <= 1:
+        return [batch]
+    keys = observation_keys(batch)
+    shard = (np.abs(keys["lat"] * 1_000_003 + keys["lon"]) + keys["observed"]) % shard_count
+    return [take_batch(batch, np.flatnonzero(shard == index)) for index in range(shard_count)
+            if np.any(shard == index)]
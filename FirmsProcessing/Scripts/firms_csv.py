@@ -0,0 +1,173 @@
+import csv
+import io
+import itertools
+import logging
+
+import numpy as np
+
+# Колонки ищутся по имени в заголовке: у MODIS и VIIRS разные названия яркостных каналов
+column_aliases = {
+    "latitude": ("latitude",),
+    "longitude": ("longitude",),
+    "brightness": ("brightness", "bright_ti4"),
+    "scan": ("scan",),
+    "track": ("track",),
+    "acq_date": ("acq_date",),
+    "acq_time": ("acq_time",),
+    "confidence": ("confidence",),
+    "version": ("version",),
+    "bright_t31": ("bright_t31", "bright_ti5"),
+    "frp": ("frp",),
+    "daynight": ("daynight",),
+}
+float_columns = ("latitude", "longitude", "brightness", "scan", "track", "bright_t31", "frp")
+categorical_columns = ("confidence", "version", "daynight")
+# Местное время Казахстана относительно UTC
+local_time_offset_minutes = 5 * 60
+# Файлы, сохраненные из Excel, начинаются с BOM; он не должен попасть в имя первой колонки
+csv_encoding = 'utf-8-sig'
+
+def resolve_columns(header):
+    positions = {name.strip().lower(): index for index, name in enumerate(header)}
+    resolved = {}
+    for column, aliases in column_aliases.items():
+        for alias in aliases:
+            if alias in positions:
+                resolved[column] = positions[alias]
+                break
+        else:
+            raise ValueError(f"FIRMS column {column} not found in header {header}")
+    return resolved
+
+def parse_float_column(values):
+    values = np.asarray(values, dtype=str)
+    return np.where(values == '', 'nan', values).astype(np.float64)
+
+def parse_coordinate_column(values):
+    coordinates = parse_float_column(values)
+    if np.isnan(coordinates).any():
+        raise ValueError("empty coordinate")
+    return coordinates
+
+def parse_date_column(values):
+    dates = np.asarray(values, dtype='datetime64[D]')
+    if np.isnat(dates).any():
+        raise ValueError("empty acq_date")
+    return dates
+
+def parse_time_column(values):
+    # HHMM разбирается арифметикой, без strptime
+    hhmm = np.asarray(values, dtype=str).astype(np.int64)
+    return hhmm // 100 * 60 + hhmm % 100
+
+column_parsers = {
+    "latitude": parse_coordinate_column,
+    "longitude": parse_coordinate_column,
+    **{column: parse_float_column for column in float_columns if column not in ("latitude", "longitude")},
+    "acq_date": parse_date_column,
+    "acq_time": parse_time_column,
+}
+
+def value_parses(parse, value):
+    try:
+        parse([value])
+    except ValueError:
+        return False
+    return True
+
+def parse_firms_rows(header, rows, satellite):
+    # Неполная или неразборная строка отбрасывается сама, а не срывает разбор всего файла
+    index = resolve_columns(header)
+    complete_rows = [row for row in rows if len(row) == len(header)]
+    columns = list(zip(*complete_rows)) if complete_rows else [()] * len(header)
+
+    batch = {"satellite": satellite, "size": len(complete_rows)}
+    invalid = np.zeros(len(complete_rows), dtype=bool)
+    for column, parse in column_parsers.items():
+        # Весь столбец разбирается сразу; только при ошибке значения проверяются по одному
+        try:
+            batch[column] = parse(columns[index[column]])
+        except ValueError:
+            invalid |= ~np.array([value_parses(parse, value) for value in columns[index[column]]], dtype=bool)
+
+    if len(complete_rows) < len(rows) or invalid.any():
+        logging.warning(f"{satellite}: dropped {len(rows) - len(complete_rows)} rows with a wrong number of fields "
+                        f"and {np.count_nonzero(invalid)} rows with unparsable values out of {len(rows)}")
+        if invalid.any():
+            return parse_firms_rows(header, [row for row, bad in zip(complete_rows, invalid) if not bad], satellite)
+
+    batch["observed"] = batch["acq_date"].astype('datetime64[m]') + batch["acq_time"].astype('timedelta64[m]')
+    batch["local_time"] = (batch["acq_time"] + local_time_offset_minutes) % 1440
+
+    for column in categorical_columns:
+        categories, codes = np.unique(np.asarray(columns[index[column]], dtype=str), return_inverse=True)
+        batch[column] = (categories, codes.reshape(-1))
+    return batch
+
+def read_firms_csv(path, satellite):
+    with open(path, 'r', newline='', encoding=csv_encoding) as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if not header:
+            return None
+        rows = [row for row in reader if row]
+    return parse_firms_rows(header, rows, satellite)
+
+def iter_firms_csv(path, satellite, chunk_rows, start_offset=0):
+    # Потоковое чтение больших архивов: пачки по chunk_rows строк и смещение в байтах после каждой пачки.
+    # Строки FIRMS не содержат переводов строки внутри полей, поэтому файл читается построчно в двоичном режиме
+    with open(path, 'rb') as file:
+        header = next(csv.reader([file.readline().decode(csv_encoding)]), None)
+        if not header:
+            return
+        if start_offset:
+            file.seek(start_offset)
+        while True:
+            lines = list(itertools.islice(file, chunk_rows))
+            if not lines:
+                return
+            rows = [row for row in csv.reader(line.decode('utf-8') for line in lines) if row]
+            yield parse_firms_rows(header, rows, satellite), file.tell()
+
+def take_batch(batch, index):
+    taken = {"satellite": batch["satellite"], "size": len(index)}
+    for column, values in batch.items():
+        if column in categorical_columns:
+            categories, codes = values
+            taken[column] = (categories, codes[index])
+        elif isinstance(values, np.ndarray):
+            taken[column] = values[index]
+    return taken
+
+def categorical_values(batch, column):
+    categories, codes = batch[column]
+    return categories[codes]
+
+def format_minutes(minutes):
+    return np.char.add(np.char.add(np.char.zfill((minutes // 60).astype(str), 2), ':'),
+                       np.char.zfill((minutes % 60).astype(str), 2))
+
+def format_float(values):
+    text = values.astype(str)
+    text[np.isnan(values)] = ''
+    return text
+
+def batch_copy_buffer(batch, columns):
+    # Текст для COPY ... FORMAT csv; пустое поле без кавычек PostgreSQL читает как NULL
+    formatted = {
+        "acq_date": batch["acq_date"].astype(str),
+        "acq_time": format_minutes(batch["acq_time"]),
+        "local_time": format_minutes(batch["local_time"]),
+        # После слияния источников спутники у каждой строки свои
+        "satellite": (np.full(batch["size"], batch["satellite"]) if isinstance(batch["satellite"], str)
+                      else batch["satellite"]),
+    }
+    for column in float_columns:
+        formatted[column] = format_float(batch[column])
+    for column in categorical_columns:
+        formatted[column] = categorical_values(batch, column)
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(zip(*(formatted[column].tolist() for column in columns)))
+    buffer.seek(0)
+    return buffer
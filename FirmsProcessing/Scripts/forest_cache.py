@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+from boundary_cache import save_npz_atomically, table_fingerprint, table_version
+
+# Размер ячейки сетки в градусах: пиксели FIRMS повторяются, поэтому ответ для ячейки переиспользуется
+cell_degrees = float(os.getenv('FORESTRY_CELL_DEGREES', '0.01'))
+# Сколько ячеек держать в кэше; при превышении вытесняются давно не использованные
+max_cached_cells = int(os.getenv('FORESTRY_CACHE_MAX_CELLS', '200000'))
+# Запас сверх лимита, после которого кэш сокращается прямо во время поиска; вытеснение идет не на каждой пачке
+eviction_slack_cells = max(1, max_cached_cells // 10)
+
+def empty_cache(fingerprint, version=None):
+    # cells: ячейка -> (кортеж forestry_id или None, если ячейку пересекает граница леса; отметка использования)
+    return {"fingerprint": fingerprint, "version": version, "cells": {}, "clock": 0, "dirty": False,
+            "lock": threading.Lock()}
+
+def load_forest_cache(cur, cache_path):
+    version = table_version(cur, "forestry_geometries")
+    fingerprint = table_fingerprint(cur, "forestry_geometries")
+    cache = empty_cache(fingerprint, version)
+    if not os.path.exists(cache_path):
+        return cache
+    try:
+        with np.load(cache_path) as cached:
+            if str(cached["fingerprint"]) != fingerprint or float(cached["cell_degrees"]) != cell_degrees:
+                logging.info("Forestry geometries changed in the database, forest lookup cache invalidated")
+                cache["dirty"] = True
+                return cache
+            offsets = cached["id_offsets"].tolist()
+            ids = cached["forestry_ids"].tolist()
+            for index, (cell, last_used, crossing) in enumerate(zip(cached["cells"].tolist(),
+                                                                    cached["last_used"].tolist(),
+                                                                    cached["crossing"].tolist())):
+                forests = None if crossing else tuple(ids[offsets[index]:offsets[index + 1]])
+                cache["cells"][cell] = (forests, last_used)
+            cache["clock"] = int(cached["clock"])
+    except Exception as e:
+        logging.warning(f"Failed to read forest lookup cache {cache_path}: {e}")
+        return empty_cache(fingerprint, version)
+    logging.info(f"Forest lookup cache loaded from {cache_path}: {len(cache['cells'])} cells")
+    return cache
+
+def refresh_forest_cache(cur, cache):
+    # Долгоживущий процесс перед каждым запуском сверяет счетчик изменений таблицы;
+    # полный отпечаток пересчитывается, только если таблицу меняли
+    version = table_version(cur, "forestry_geometries")
+    if version == cache["version"]:
+        return
+    fingerprint = table_fingerprint(cur, "forestry_geometries")
+    cache["version"] = version
+    if fingerprint != cache["fingerprint"]:
+        logging.info("Forestry geometries changed in the database, forest lookup cache invalidated")
+        with cache["lock"]:
+            cache.update(fingerprint=fingerprint, cells={}, dirty=True)
+
+def evict_cells(cache):
+    # Вытеснение LRU: остаются ячейки с самыми свежими отметками использования; вызывается под cache["lock"]
+    entries = sorted(cache["cells"].items(), key=lambda item: item[1][1], reverse=True)[:max_cached_cells]
+    cache["cells"] = dict(entries)
+    return entries
+
+def save_forest_cache(cache, cache_path):
+    with cache["lock"]:
+        if not cache["dirty"]:
+            return
+        entries = evict_cells(cache)
+        cache["dirty"] = False
+    offsets = [0]
+    ids = []
+    for _, (forests, _) in entries:
+        ids.extend(forests or ())
+        offsets.append(len(ids))
+    save_npz_atomically(cache_path,
+                        fingerprint=np.array(cache["fingerprint"]), cell_degrees=np.array(cell_degrees),
+                        clock=np.array(cache["clock"]),
+                        cells=np.array([cell for cell, _ in entries], dtype=np.int64),
+                        last_used=np.array([last_used for _, (_, last_used) in entries], dtype=np.int64),
+                        crossing=np.array([forests is None for _, (forests, _) in entries], dtype=bool),
+                        id_offsets=np.array(offsets, dtype=np.int64),
+                        forestry_ids=np.array(ids, dtype=np.int64))
+    logging.info(f"Forest lookup cache saved to {cache_path}: {len(entries)} cells")
+
+def grid_cells(lat, lon):
+    rows = np.floor(np.asarray(lat, dtype=np.float64) / cell_degrees).astype(np.int64)
+    cols = np.floor(np.asarray(lon, dtype=np.float64) / cell_degrees).astype(np.int64)
+    return (rows << 32) + (cols + (1 << 31)), rows, cols
+
+def classify_cells(cur, rows, cols):
+    # Ячейка целиком внутри лесов (ST_ContainsProperly) или вне всех лесов получает готовый ответ;
+    # ячейка, которую пересекает граница хотя бы одного леса, проверяется потом по каждой точке
+    cur.execute("""
+        SELECT c.row_index, c.col_index,
+               coalesce(array_agg(g.forestry_id) FILTER (WHERE g.forestry_id IS NOT NULL), '{}'),
+               coalesce(bool_or(g.forestry_id IS NOT NULL AND NOT ST_ContainsProperly(g.geom, e.envelope)), FALSE)
+        FROM unnest(%s::bigint[], %s::bigint[]) AS c(row_index, col_index)
+        CROSS JOIN LATERAL (
+            -- Небольшой запас покрывает ошибку округления при делении координаты на размер ячейки
+            SELECT ST_Expand(ST_MakeEnvelope(c.col_index * %s, c.row_index * %s,
+                                             (c.col_index + 1) * %s, (c.row_index + 1) * %s, 4326), 1e-9) AS envelope
+        ) e
+        LEFT JOIN forestry_geometries g ON ST_Intersects(g.geom, e.envelope)
+        GROUP BY c.row_index, c.col_index
+    """, (rows, cols, cell_degrees, cell_degrees, cell_degrees, cell_degrees))
+    return {(row << 32) + (col + (1 << 31)): (None if crossing else tuple(ids))
+            for row, col, ids, crossing in cur.fetchall()}
+
+def lookup_forests(cache, cur, lat, lon, totals):
+    # Возвращает для каждой точки кортеж forestry_id или None, если нужна точная проверка в PostGIS
+    cells, rows, cols = grid_cells(lat, lon)
+    unique_cells, first_rows, inverse = np.unique(cells, return_index=True, return_inverse=True)
+    unique_cells = unique_cells.tolist()
+
+    with cache["lock"]:
+        cache["clock"] += 1
+        clock = cache["clock"]
+        known = {cell: cache["cells"][cell][0] for cell in unique_cells if cell in cache["cells"]}
+    missing = np.array([index for index, cell in enumerate(unique_cells) if cell not in known], dtype=np.int64)
+    if len(missing):
+        known.update(classify_cells(cur, rows[first_rows[missing]].tolist(), cols[first_rows[missing]].tolist()))
+
+    with cache["lock"]:
+        for cell in unique_cells:
+            cache["cells"][cell] = (known[cell], clock)
+        cache["dirty"] = True
+        # Многочасовая загрузка архива сохраняет кэш только в конце, поэтому размер ограничивается и здесь
+        if len(cache["cells"]) > max_cached_cells + eviction_slack_cells:
+            evict_cells(cache)
+
+    forests = [known[cell] for cell in unique_cells]
+    hit = np.isin(np.arange(len(unique_cells)), missing, invert=True)[inverse.reshape(-1)]
+    totals["forest_cache_hits"] += int(np.count_nonzero(hit))
+    totals["forest_cache_misses"] += int(len(hit) - np.count_nonzero(hit))
+    return [forests[index] for index in inverse.reshape(-1).tolist()]
@@ -39,15 +39,11 @@ def manage_cron_jobs(cron_jobs, cron):
 
     cron.write()
 
-def generate_cron_jobs(passlist_path, script_path, cron):
-    if not os.path.exists(passlist_path):
-        logging.error(f"Passlist file {passlist_path} does not exist.")
-        return
-    if not os.path.exists(script_path):
-        logging.error(f"Script file {script_path} does not exist.")
-        return
+# Задания запускаются через 3 часа после пролета спутника
+PASS_OFFSET = timedelta(hours=3)
 
-    cron_jobs = []
+def parse_pass_times(passlist_path):
+    pass_times = []
     date_pattern = re.compile(r"\d{2} \w{3} \d{4}")
 
     try:
@@ -66,17 +62,29 @@ def generate_cron_jobs(passlist_path, script_path, cron):
                     except ValueError as e:
                         logging.error(f"Date parsing error: {e}")
                         continue
-                    scheduled_time = pass_datetime + timedelta(hours=3)
-                    cron_job_command = f"{PYTHON_PATH} {script_path} >> /var/log/app.log 2>&1"
-                    cron_job_time = f"{scheduled_time.minute} {scheduled_time.hour} {scheduled_time.day} {scheduled_time.month} *"
-                    comment = f"job_{hash(line)}"
-                    cron_job = f"{cron_job_command}|||{cron_job_time}|||{comment}"
-                    cron_jobs.append(cron_job)
-                    logging.info(f"Generated cron job: {comment} with time {cron_job_time}")
+                    pass_times.append((line, pass_datetime + PASS_OFFSET))
                 else:
                     logging.warning(f"Line skipped due to incorrect format: {line}")
     except Exception as e:
         logging.error(f"Error processing PassList.txt: {e}")
+    return pass_times
+
+def generate_cron_jobs(passlist_path, script_path, cron):
+    if not os.path.exists(passlist_path):
+        logging.error(f"Passlist file {passlist_path} does not exist.")
+        return
+    if not os.path.exists(script_path):
+        logging.error(f"Script file {script_path} does not exist.")
+        return
+
+    cron_jobs = []
+    for line, scheduled_time in parse_pass_times(passlist_path):
+        cron_job_command = f"{PYTHON_PATH} {script_path} >> /var/log/app.log 2>&1"
+        cron_job_time = f"{scheduled_time.minute} {scheduled_time.hour} {scheduled_time.day} {scheduled_time.month} *"
+        comment = f"job_{hash(line)}"
+        cron_job = f"{cron_job_command}|||{cron_job_time}|||{comment}"
+        cron_jobs.append(cron_job)
+        logging.info(f"Generated cron job: {comment} with time {cron_job_time}")
 
     manage_cron_jobs(cron_jobs, cron)
 
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from boundary_cache import save_npz_atomically
+
+manifest_file = "manifest.json"
+fingerprints_file = "row_fingerprints.npz"
+# Суточный файл FIRMS и 24-часовое окно архивации: отпечатки старше двух суток уже не встретятся
+manifest_retention_minutes = int(os.getenv('MANIFEST_RETENTION_HOURS', '48')) * 60
+
+def load_manifest(directory):
+    directory = Path(directory)
+    manifest = {"files": {}, "fingerprints": np.empty(0, dtype=np.uint64), "observed": np.empty(0, dtype=np.int64)}
+    try:
+        if (directory / manifest_file).exists():
+            manifest["files"] = json.loads((directory / manifest_file).read_text())
+        if (directory / fingerprints_file).exists():
+            with np.load(directory / fingerprints_file) as stored:
+                manifest["fingerprints"] = stored["fingerprints"]
+                manifest["observed"] = stored["observed"]
+    except Exception as e:
+        # Потеря манифеста означает лишь одну полную переобработку
+        logging.warning(f"Processed-file manifest in {directory} is unreadable, starting from scratch: {e}")
+        return {"files": {}, "fingerprints": np.empty(0, dtype=np.uint64), "observed": np.empty(0, dtype=np.int64)}
+    return manifest
+
+def save_manifest(manifest, directory):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp_path = directory / (manifest_file + ".tmp")
+    tmp_path.write_text(json.dumps(manifest["files"], indent=2, sort_keys=True))
+    os.replace(tmp_path, directory / manifest_file)
+    save_npz_atomically(directory / fingerprints_file,
+                        fingerprints=manifest["fingerprints"], observed=manifest["observed"])
+
+def file_signature(path, manifest):
+    stat = os.stat(path)
+    known = manifest["files"].get(str(path))
+    # Размер и время изменения совпали — содержимое не перечитываем
+    if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return {"sha256": digest.hexdigest(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def is_file_unchanged(manifest, path, signature):
+    known = manifest["files"].get(str(path))
+    return bool(known) and known["sha256"] == signature["sha256"]
+
+def record_file(manifest, path, signature):
+    manifest["files"][str(path)] = signature
+
+def splitmix64(values):
+    with np.errstate(over='ignore'):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+def row_fingerprints(lat, lon, observed_minutes, satellite):
+    # 64-битный отпечаток (lat, lon, acq_date, acq_time, satellite); координаты FIRMS даны с точностью 1e-5
+    parts = (
+        np.round(np.asarray(lat) * 1e5).astype(np.int64),
+        np.round(np.asarray(lon) * 1e5).astype(np.int64),
+        np.asarray(observed_minutes, dtype=np.int64),
+    )
+    fingerprints = splitmix64(np.full(len(parts[0]), zlib.crc32(satellite.encode()), dtype=np.uint64))
+    for part in parts:
+        fingerprints = splitmix64(fingerprints ^ part.astype(np.uint64))
+    return fingerprints
+
+def new_rows_mask(manifest, fingerprints):
+    return ~np.isin(fingerprints, manifest["fingerprints"])
+
+def add_fingerprints(manifest, fingerprints, observed_minutes):
+    fingerprints = np.concatenate([manifest["fingerprints"], fingerprints])
+    observed = np.concatenate([manifest["observed"], np.asarray(observed_minutes, dtype=np.int64)])
+    order = np.argsort(fingerprints, kind='stable')
+    fingerprints, observed = fingerprints[order], observed[order]
+    keep = np.ones(len(fingerprints), dtype=bool)
+    keep[:-1] = fingerprints[1:] != fingerprints[:-1]
+    manifest["fingerprints"], manifest["observed"] = fingerprints[keep], observed[keep]
+
+def prune_manifest(manifest):
+    if len(manifest["observed"]):
+        keep = manifest["observed"] >= manifest["observed"].max() - manifest_retention_minutes
+        manifest["fingerprints"], manifest["observed"] = manifest["fingerprints"][keep], manifest["observed"][keep]
+    manifest["files"] = {path: signature for path, signature in manifest["files"].items() if os.path.exists(path)}
@@ -0,0 +1,175 @@
+import os
+import re
+import sys
+import logging
+from datetime import date, timedelta
+
+import psycopg2
+
+db_config = {
+    "host": os.getenv('DB_HOST', 'localhost'),
+    "dbname": os.getenv('DB_NAME'),
+    "user": os.getenv('DB_USER'),
+    "password": os.getenv('DB_PASSWORD')
+}
+
+# fires живет около суток, поэтому делится по дням; архив растет годами и делится по месяцам
+partition_step = {"fires": "day", "archived_fires": "month"}
+partition_days_ahead = int(os.getenv('PARTITION_DAYS_AHEAD', '7'))
+# 0 — хранить архив бессрочно
+archive_retention_months = int(os.getenv('ARCHIVE_RETENTION_MONTHS', '0'))
+drop_detached_partitions = os.getenv('ARCHIVE_DROP_DETACHED', '0') == '1'
+
+bound_pattern = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (table,))
+    return cur.fetchone()[0]
+
+def list_partitions(cur, parent):
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (parent,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = bound_pattern.search(bound)
+        if match:
+            lower, upper = (date.fromisoformat(value) for value in match.groups())
+            partitions.append((name, lower, upper))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def month_start(day, shift=0):
+    month_index = day.year * 12 + day.month - 1 + shift
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def partition_bounds(table, day):
+    if partition_step[table] == "day":
+        return f"{table}_p{day:%Y%m%d}", day, day + timedelta(days=1)
+    lower = month_start(day)
+    return f"{table}_p{lower:%Y%m}", lower, month_start(day, 1)
+
+def create_partition(cur, table, day):
+    name, lower, upper = partition_bounds(table, day)
+    # Точка сохранения: если строки этого диапазона уже лежат в DEFAULT-секции, пропускаем ее, не ломая транзакцию
+    cur.execute("SAVEPOINT create_partition")
+    try:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+            FOR VALUES FROM (%s) TO (%s)
+        """, (lower.isoformat(), upper.isoformat()))
+        cur.execute("RELEASE SAVEPOINT create_partition")
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT create_partition")
+        logging.warning(f"Could not create partition {name}: {e}")
+
+def ensure_partitions(cur, today=None):
+    today = today or date.today()
+    if is_partitioned(cur, "fires"):
+        # Суточные файлы FIRMS содержат и вчерашние наблюдения
+        for offset in range(-1, partition_days_ahead + 1):
+            create_partition(cur, "fires", today + timedelta(days=offset))
+    if is_partitioned(cur, "archived_fires"):
+        for shift in range(0, 2):
+            create_partition(cur, "archived_fires", month_start(today, shift))
+
+def expired_partitions(cur, table, cutoff_date):
+    return [name for name, _, upper in list_partitions(cur, table) if upper <= cutoff_date]
+
+def detach_partition(cur, table, name):
+    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+    logging.info(f"Detached partition {name} from {table}")
+
+def apply_archive_retention(cur, today=None):
+    if not archive_retention_months or not is_partitioned(cur, "archived_fires"):
+        return
+    today = today or date.today()
+    keep_from = month_start(today, -archive_retention_months)
+    for name in expired_partitions(cur, "archived_fires", keep_from):
+        detach_partition(cur, "archived_fires", name)
+        if drop_detached_partitions:
+            cur.execute(f"""
+                DELETE FROM archived_fire_forest_relations r
+                USING {name} p
+                WHERE r.fire_id = p.id
+            """)
+            cur.execute(f"DROP TABLE {name}")
+            logging.info(f"Dropped archived partition {name}")
+        else:
+            logging.info(f"Partition {name} kept as a standalone table for dump or compression")
+
+def convert_to_partitioned(conn, table):
+    legacy = f"{table}_legacy"
+    with conn.cursor() as cur:
+        if is_partitioned(cur, table):
+            logging.info(f"Table {table} is already partitioned")
+            return
+
+        cur.execute("SELECT min(acq_date), max(acq_date) FROM " + table)
+        first_day, last_day = cur.fetchone()
+        cur.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", (table,))
+        indexes = cur.fetchall()
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+        sequence = cur.fetchone()[0]
+
+        cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        cur.execute(f"""
+            CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)
+            PARTITION BY RANGE (acq_date)
+        """)
+        # У секционированной таблицы ключ обязан включать колонку секционирования
+        cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_partitioned_pkey PRIMARY KEY (id, acq_date)")
+        if sequence:
+            cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+
+        # Внешние ключи на старую таблицу невозможны для секционированной — снимаем их
+        cur.execute("""
+            SELECT conname, conrelid::regclass::text FROM pg_constraint
+            WHERE confrelid = %s::regclass AND contype = 'f'
+        """, (legacy,))
+        for constraint, referencing_table in cur.fetchall():
+            cur.execute(f"ALTER TABLE {referencing_table} DROP CONSTRAINT {constraint}")
+            logging.warning(f"Dropped foreign key {constraint} on {referencing_table} referencing {table}")
+
+        for index_name, index_def in indexes:
+            index_def = re.sub(rf"INDEX {index_name} ON (\S+\.)?{table} ", rf"INDEX {index_name}_p ON \g<1>{table} ", index_def)
+            cur.execute("SAVEPOINT copy_index")
+            try:
+                cur.execute(index_def)
+                cur.execute("RELEASE SAVEPOINT copy_index")
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT copy_index")
+                logging.warning(f"Index {index_name} not recreated on partitioned {table}: {e}")
+
+        if first_day:
+            day = first_day
+            while day <= last_day:
+                create_partition(cur, table, day)
+                day = partition_bounds(table, day)[2]
+        ensure_partitions(cur)
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+
+        # Вычисляемые колонки (observed_at) заполняются заново, копировать их значения нельзя
+        cur.execute("""
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+            ORDER BY attnum
+        """, (legacy,))
+        columns = ", ".join(name for name, in cur.fetchall())
+        cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy}")
+        logging.info(f"Copied {cur.rowcount} rows from {legacy} into partitioned {table}")
+    conn.commit()
+    logging.info(f"Table {table} converted; drop {legacy} after checking the data")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename='/var/log/app.log')
+    with psycopg2.connect(**db_config) as conn:
+        if len(sys.argv) > 1 and sys.argv[1] == "convert":
+            for table in partition_step:
+                convert_to_partitioned(conn, table)
+        with conn.cursor() as cur:
+            ensure_partitions(cur)
+            apply_archive_retention(cur)
+        conn.commit()
@@ -0,0 +1,144 @@
+import logging
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+
+from pipeline_metrics import metered_run, setup_logging
+
+# Настройка логирования
+setup_logging()
+logging.info('Starting pipeline daemon.')
+
+from archive_data import archive_data
+from boundary_cache import load_boundary
+from dwnld_firms import create_session, download_data, urls
+from generate_cron import parse_pass_times
+from forest_cache import load_forest_cache
+from process_data import (boundary_cache_path, create_connection_pool, forest_cache_path, log_run_totals,
+                          prepare_database, process_data)
+from run_lock import run_single_flight
+
+passlist_path = "/app/FirmsProcessing/PassList.txt"
+# Плановый запуск по интервалу (прежний */15 в cron) дополняется запусками по времени пролета спутников
+pipeline_interval = timedelta(minutes=int(os.getenv('PIPELINE_INTERVAL_MINUTES', '15')))
+# Граница и миграции меняются редко: перечитываются раз в заданный срок, а не на каждом запуске
+boundary_refresh_interval = timedelta(hours=int(os.getenv('BOUNDARY_REFRESH_HOURS', '24')))
+database_prepare_interval = timedelta(hours=24)
+
+stop_event = threading.Event()
+
+def handle_stop_signal(signum, frame):
+    logging.info(f"Received signal {signum}, stopping after the current run.")
+    stop_event.set()
+
+def load_pass_schedule(schedule, now):
+    # PassList.txt перечитывается только при изменении файла; прошедшие пролеты отбрасываются
+    try:
+        mtime = os.stat(passlist_path).st_mtime_ns
+    except OSError:
+        return
+    if schedule.get("passlist_mtime") == mtime:
+        return
+    schedule["passlist_mtime"] = mtime
+    schedule["pass_times"] = sorted(scheduled_time for _, scheduled_time in parse_pass_times(passlist_path)
+                                    if scheduled_time > now)
+    logging.info(f"Loaded {len(schedule['pass_times'])} upcoming pass-time runs from {passlist_path}")
+
+def next_run(schedule):
+    pass_times = schedule.get("pass_times")
+    if pass_times and pass_times[0] < schedule["next_interval_run"]:
+        return pass_times[0], "pass time"
+    return schedule["next_interval_run"], "interval"
+
+def complete_run(schedule, now):
+    schedule["next_interval_run"] = now + pipeline_interval
+    # Пролеты, время которых наступило во время запуска, уже покрыты этим запуском
+    schedule["pass_times"] = [scheduled_time for scheduled_time in schedule.get("pass_times", [])
+                              if scheduled_time > now]
+
+def refresh_resources(resources, now):
+    if resources["pool"] is None:
+        resources["pool"] = create_connection_pool()
+        resources["prepared_at"] = None
+    if resources["prepared_at"] is None or now - resources["prepared_at"] >= database_prepare_interval:
+        conn = resources["pool"].getconn()
+        try:
+            prepare_database(conn)
+        finally:
+            resources["pool"].putconn(conn)
+        resources["prepared_at"] = now
+    if resources["boundary"] is None or now - resources["boundary_loaded_at"] >= boundary_refresh_interval:
+        conn = resources["pool"].getconn()
+        try:
+            with conn.cursor() as cur:
+                resources["boundary"] = load_boundary(cur, boundary_cache_path)
+                if resources["forest_cache"] is None:
+                    resources["forest_cache"] = load_forest_cache(cur, forest_cache_path)
+            conn.commit()
+        finally:
+            resources["pool"].putconn(conn)
+        resources["boundary_loaded_at"] = now
+
+def reset_connections(resources):
+    # После ошибки соединения могут быть разорваны: пул пересоздается на следующем запуске
+    if resources["pool"] is not None:
+        resources["pool"].closeall()
+    resources["pool"] = None
+
+def run_stages(resources):
+    with metered_run("pipeline_daemon") as totals:
+        refresh_resources(resources, datetime.utcnow())
+        changed_feeds = download_data(session=resources["session"])
+        totals["feeds_changed"] = len(changed_feeds)
+        # Обработка не зависит от скачивания: строки, не записанные прошлым запуском, повторяются по манифесту,
+        # а неизменившиеся файлы пропускаются по хэшу
+        totals.update(process_data(pool=resources["pool"], boundary=resources["boundary"],
+                                   forest_cache=resources["forest_cache"]))
+        log_run_totals(totals)
+
+        conn = resources["pool"].getconn()
+        try:
+            totals["points_archived"] = archive_data(conn)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            resources["pool"].putconn(conn)
+        logging.info("Pipeline run finished successfully.")
+
+def run_pipeline(resources, reason):
+    logging.info(f"Pipeline run started ({reason}).")
+    try:
+        # Разовый запуск вручную мог начаться раньше: тогда этот запуск будет повторен им после окончания
+        run_single_flight(lambda: run_stages(resources), f"pipeline_daemon.py ({reason})")
+    except Exception as e:
+        logging.error(f"Pipeline run failed: {e}")
+        reset_connections(resources)
+
+def main():
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.signal(signal.SIGINT, handle_stop_signal)
+
+    resources = {"pool": None, "session": create_session(len(urls)), "boundary": None, "forest_cache": None,
+                 "boundary_loaded_at": None, "prepared_at": None}
+    # Первый запуск сразу после старта, как прежнее одноразовое задание create_cron_job.py
+    schedule = {"next_interval_run": datetime.utcnow()}
+    try:
+        while not stop_event.is_set():
+            now = datetime.utcnow()
+            load_pass_schedule(schedule, now)
+            run_at, reason = next_run(schedule)
+            if run_at > now:
+                # Ожидание прерывается сигналом остановки; PassList.txt проверяется не реже раза в минуту
+                stop_event.wait(min((run_at - now).total_seconds(), 60))
+                continue
+            run_pipeline(resources, reason)
+            complete_run(schedule, datetime.utcnow())
+    finally:
+        reset_connections(resources)
+        resources["session"].close()
+        logging.info('Pipeline daemon stopped.')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import psycopg2.extensions
+
+log_file = "/var/log/app.log"
+log_format = '%(asctime)s - %(levelname)s - %(message)s'
+log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Итоги запусков: последний запуск в JSON, история построчно и textfile для node_exporter
+metrics_directory = Path(os.getenv('METRICS_DIRECTORY', '/app/FirmsProcessing/Metrics'))
+last_run_file = "last_run.json"
+run_history_file = "runs.jsonl"
+prometheus_textfile = Path(os.getenv('METRICS_TEXTFILE', str(metrics_directory / "firms_pipeline.prom")))
+
+metrics_lock = threading.Lock()
+current_run = None
+# Этап, к которому относятся обращения к БД из текущего потока
+stage_context = threading.local()
+
+class SamplingFilter(logging.Filter):
+    # Запись с extra={"sample_every": N} из одной строки кода проходит один раз из N
+    def __init__(self):
+        super().__init__()
+        self.seen = Counter()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        every = getattr(record, "sample_every", 1)
+        if every <= 1:
+            return True
+        with self.lock:
+            self.seen[(record.pathname, record.lineno)] += 1
+            seen = self.seen[(record.pathname, record.lineno)]
+        return seen % every == 1
+
+def setup_logging(filename=log_file):
+    # Запись в файл идет в отдельном потоке; горячие пути не ждут диск
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(log_format))
+    sampling_filter = SamplingFilter()
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(sampling_filter)
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    root.addHandler(queue_handler)
+    root.setLevel(log_level)
+
+    def write_directly_in_child():
+        # В дочернем процессе нет потока-слушателя очереди, поэтому пишем в файл напрямую
+        root.removeHandler(queue_handler)
+        file_handler.addFilter(sampling_filter)
+        root.addHandler(file_handler)
+
+    os.register_at_fork(after_in_child=write_directly_in_child)
+
+def metric_key(name, **labels):
+    return name, tuple(sorted(labels.items()))
+
+@contextmanager
+def timed(counter, stage):
+    # Время этапа в переданный Counter; используется там, где нет общего реестра (процессы-обработчики)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        counter[metric_key("stage_seconds", stage=stage)] += time.perf_counter() - started
+
+def start_run(name):
+    global current_run
+    with metrics_lock:
+        current_run = {"run": name, "started_at": datetime.utcnow().isoformat(timespec='seconds'),
+                       "started": time.monotonic(), "metrics": Counter()}
+
+def add_metrics(counter):
+    with metrics_lock:
+        if current_run is not None:
+            current_run["metrics"].update(counter)
+
+def count(name, value=1, **labels):
+    add_metrics({metric_key(name, **labels): value})
+
+@contextmanager
+def stage_label(stage):
+    previous = getattr(stage_context, "stage", None)
+    stage_context.stage = stage
+    try:
+        yield
+    finally:
+        stage_context.stage = previous
+
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        with stage_label(stage):
+            yield
+    finally:
+        count("stage_seconds", time.perf_counter() - started, stage=stage)
+
+class CountingCursor(psycopg2.extensions.cursor):
+    # Каждый вызов — одно обращение к серверу; executemany обращается к нему на каждую строку
+    def execute(self, query, vars=None):
+        count("db_round_trips", stage=getattr(stage_context, "stage", None) or "other")
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        count("db_round_trips", len(vars_list), stage=getattr(stage_context, "stage", None) or "other")
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        count("db_round_trips", stage=getattr(stage_context, "stage", None) or "other")
+        return super().copy_expert(sql, file, size)
+
+def write_atomically(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+def prometheus_text(record):
+    lines = []
+    metrics = {}
+    for (name, labels), value in record["metrics"]:
+        metrics.setdefault(name, []).append((labels, value))
+    metrics["run_duration_seconds"] = [({}, record["duration_seconds"])]
+    metrics["run_success"] = [({}, 1 if record["status"] == "ok" else 0)]
+    metrics["run_finished_timestamp_seconds"] = [({}, record["finished_timestamp"])]
+    metrics["run_points"] = [({"kind": kind}, value) for kind, value in sorted(record["totals"].items())]
+    for name, samples in sorted(metrics.items()):
+        lines.append(f"# TYPE firms_{name} gauge")
+        for labels, value in samples:
+            labels = dict(labels, run=record["run"])
+            label_text = ",".join(f'{key}="{label}"' for key, label in sorted(labels.items()))
+            lines.append(f"firms_{name}{{{label_text}}} {value}")
+    return "\n".join(lines) + "\n"
+
+def finish_run(status="ok", totals=None):
+    global current_run
+    with metrics_lock:
+        run, current_run = current_run, None
+    if run is None:
+        return None
+    record = {
+        "run": run["run"],
+        "status": status,
+        "started_at": run["started_at"],
+        "duration_seconds": round(time.monotonic() - run["started"], 3),
+        "finished_timestamp": round(time.time(), 3),
+        "totals": dict(totals or {}),
+        "metrics": [([name, dict(labels)], round(value, 6)) for (name, labels), value in sorted(run["metrics"].items())],
+    }
+    try:
+        write_atomically(metrics_directory / last_run_file, json.dumps(record, indent=2))
+        with open(metrics_directory / run_history_file, 'a') as file:
+            file.write(json.dumps(record) + "\n")
+        write_atomically(prometheus_textfile, prometheus_text(record))
+    except OSError as e:
+        logging.warning(f"Failed to write run metrics: {e}")
+    stages = {labels["stage"]: value for (name, labels), value in record["metrics"] if name == "stage_seconds"}
+    logging.info(f"Run {record['run']} {status} in {record['duration_seconds']:.1f}s, stages: "
+                 + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages.items()))
+    return record
+
+@contextmanager
+def metered_run(name):
+    # Итоги запуска (Counter) заполняет вызывающий код; запись сохраняется и при ошибке
+    start_run(name)
+    totals = Counter()
+    try:
+        yield totals
+    except Exception:
+        finish_run("failed", totals)
+        raise
+    finish_run("ok", totals)
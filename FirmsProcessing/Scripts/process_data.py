@@ -1,18 +1,35 @@
-import csv
 import os
 import psycopg2
-from datetime import datetime, timedelta
+import psycopg2.pool
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import logging
-import subprocess
-from decimal import Decimal
+
+import numpy as np
+
+from boundary_cache import load_boundary, points_in_boundary
+from db_migrations import apply_migrations
+from fire_aggregates import update_aggregates
+from fire_merge import merge_feeds, shard_batch
+from forest_cache import load_forest_cache, lookup_forests, refresh_forest_cache, save_forest_cache
+from firms_csv import batch_copy_buffer, read_firms_csv, take_batch
+from ingest_manifest import (add_fingerprints, file_signature, is_file_unchanged, load_manifest, new_rows_mask,
+                             prune_manifest, record_file, row_fingerprints, save_manifest)
+from partitions import ensure_partitions
+from pipeline_metrics import (CountingCursor, add_metrics, metered_run, metric_key, setup_logging, stage_label,
+                              stage_timer, timed)
 
 # Настройка логирования
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename='/var/log/app.log')
+setup_logging()
 logging.info('Starting data processing script execution.')
 
 download_directory = "/app/FirmsProcessing/DownloadedData"
 processed_directory = "/app/FirmsProcessing/ProcessedData"
+boundary_cache_path = "/app/FirmsProcessing/Cache/boundary.npz"
+forest_cache_path = "/app/FirmsProcessing/Cache/forest_cells.npz"
+# Инкрементальный режим: неизменившиеся файлы и уже загруженные строки пропускаются по манифесту
+incremental_mode = os.getenv('FIRMS_INCREMENTAL', '1') == '1'
 
 db_config = {
     "host": os.getenv('DB_HOST', 'localhost'),
@@ -21,156 +38,373 @@ db_config = {
     "password": os.getenv('DB_PASSWORD')
 }
 
-# Глобальные переменные для счетчиков
-total_points_all_files = 0
-points_within_kazakhstan_all_files = 0
-added_points_all_files = 0
-updated_points_all_files = 0
-total_files_processed = 0
+# Разбор и предфильтрация файлов идут в отдельных процессах, запись в БД — через пул соединений
+feed_workers = int(os.getenv('FIRMS_WORKERS', '0')) or os.cpu_count() or 1
+db_pool_size = int(os.getenv('DB_POOL_SIZE', '4'))
+# Меньшие пачки пишутся одним соединением: параллельность не окупает накладные расходы
+min_rows_per_shard = int(os.getenv('DB_MIN_ROWS_PER_SHARD', '5000'))
+
+# Состояние процесса-обработчика, передается один раз при его запуске
+worker_state = {}
+
+class IngestError(Exception):
+    pass
+
+# Пространственные индексы, без которых пакетные ST_Contains превращаются в полный перебор
+spatial_indexes = {
+    "boundaries": "boundaries_geom_gist",
+    "forestry_geometries": "forestry_geometries_geom_gist",
+}
+
+def ensure_spatial_indexes(cur):
+    for table, index_name in spatial_indexes.items():
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_am am ON am.oid = c.relam
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                WHERE i.indrelid = %s::regclass AND am.amname = 'gist' AND a.attname = 'geom'
+            )
+        """, (table,))
+        if not cur.fetchone()[0]:
+            logging.info(f"Creating GiST index {index_name} on {table}(geom)")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING GIST (geom)")
+
+# Колонки временной таблицы, в которую файл загружается через COPY
+staging_columns = ("latitude", "longitude", "brightness", "scan", "track", "acq_date", "acq_time", "local_time",
+                   "satellite", "confidence", "version", "bright_t31", "frp", "daynight")
+fire_key = ("latitude", "longitude", "acq_date", "acq_time")
+
+def key_condition(left, right):
+    return " AND ".join(f"{left}.{column} = {right}.{column}" for column in fire_key)
+
+def create_staging_table(cur):
+    # Типы колонок берем из самой таблицы fires, чтобы сравнение ключей совпадало с прежним
+    cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS fires_staging AS
+        SELECT {', '.join(staging_columns)} FROM fires WITH NO DATA
+    """)
+    cur.execute("TRUNCATE fires_staging")
+
+def copy_batch_to_staging(batch, cur):
+    buffer = batch_copy_buffer(batch, staging_columns)
+    cur.copy_expert(f"COPY fires_staging ({', '.join(staging_columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def merge_staging_into_fires(cur):
+    key_match = key_condition("f", "s")
 
-def is_within_kazakhstan(lat, lon, cur):
+    # Повторы одной точки внутри пакета: оставляем первую строку, как и при построчной вставке
+    cur.execute(f"""
+        DELETE FROM fires_staging d
+        USING fires_staging s
+        WHERE d.ctid > s.ctid AND {key_condition('d', 's')}
+    """)
+
+    # В staging спутники уже объединены в памяти; к существующей точке добавляются только новые
+    existing = "coalesce(f.satellites, string_to_array(f.satellite, ','))"
+    added = f"""ARRAY(
+        SELECT name FROM unnest(string_to_array(s.satellite, ',')) WITH ORDINALITY AS t(name, position)
+        WHERE name <> ALL({existing})
+        ORDER BY position
+    )"""
+    cur.execute(f"""
+        UPDATE fires f
+        SET satellites = {existing} || {added},
+            satellite = array_to_string({existing} || {added}, ',')
+        FROM fires_staging s
+        WHERE {key_match}
+          AND NOT string_to_array(s.satellite, ',') <@ {existing}
+        RETURNING f.id
+    """)
+    updated_ids = [fire_id for fire_id, in cur.fetchall()]
+
+    columns = ", ".join(staging_columns)
+    cur.execute(f"""
+        INSERT INTO fires ({columns}, satellites, geom)
+        SELECT {', '.join('s.' + column for column in staging_columns)},
+               string_to_array(s.satellite, ','),
+               ST_SetSRID(ST_MakePoint(s.longitude, s.latitude), 4326)
+        FROM fires_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM fires f WHERE {key_match})
+        RETURNING id, latitude, longitude
+    """)
+    inserted = cur.fetchall()
+    return inserted, updated_ids
+
+def filter_staging_by_boundary(cur):
+    # Одна пространственная связка со всей пачкой вместо запроса на каждую точку
     cur.execute("""
-        SELECT EXISTS (
-            SELECT 1 FROM boundaries 
-            WHERE ST_Contains(geom, ST_GeomFromText('POINT(%s %s)', 4326))
+        DELETE FROM fires_staging s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM boundaries b
+            WHERE ST_Contains(b.geom, ST_SetSRID(ST_MakePoint(s.longitude, s.latitude), 4326))
         )
-    """, (lon, lat))
+    """)
+    cur.execute("SELECT count(*) FROM fires_staging")
     return cur.fetchone()[0]
 
-def get_forests_for_point(lat, lon, cur):
-    cur.execute("""
-        SELECT forestry_id FROM forestry_geometries 
-        WHERE ST_Contains(geom, ST_GeomFromText('POINT(%s %s)', 4326))
-    """, (lon, lat))
-    return [row[0] for row in cur.fetchall()]
+def create_forest_relations(inserted, cur, forest_cache=None):
+    # Для ячеек сетки, целиком лежащих в лесах или вне их, связи берутся из кэша;
+    # ST_Contains по отдельным точкам выполняется только в ячейках, которые пересекает граница леса
+    stats = Counter()
+    fire_ids = [fire_id for fire_id, _, _ in inserted]
+    pairs = []
+    if forest_cache is None:
+        exact_ids = fire_ids
+    else:
+        forests = lookup_forests(forest_cache, cur, [lat for _, lat, _ in inserted],
+                                 [lon for _, _, lon in inserted], stats)
+        exact_ids = [fire_id for fire_id, point_forests in zip(fire_ids, forests) if point_forests is None]
+        pairs = [(fire_id, forestry_id) for fire_id, point_forests in zip(fire_ids, forests)
+                 for forestry_id in point_forests or ()]
 
-def create_temp_table_for_current_points(cur, current_points):
-    try:
-        cur.execute("CREATE TEMP TABLE current_points (latitude DOUBLE PRECISION, longitude DOUBLE PRECISION, acq_date DATE, acq_time TIME)")
-        insert_query = "INSERT INTO current_points (latitude, longitude, acq_date, acq_time) VALUES (%s, %s, %s, %s)"
-        cur.executemany(insert_query, list(current_points))
-    except Exception as e:
-        logging.error(f"Error creating or populating temporary table 'current_points': {e}")
-        raise
-
-def insert_or_update_db(row, cur, conn, satellite, added_points, updated_points):
-    try:
-        lat, lon = Decimal(row[0]), Decimal(row[1])
-        acq_date = datetime.strptime(row[5], "%Y-%m-%d").date()
-        acq_time = datetime.strptime(row[6], "%H%M").time()
-        local_time = (datetime.combine(acq_date, acq_time) + timedelta(hours=5)).time()
-        brightness, scan, track = Decimal(row[2]), Decimal(row[3]), Decimal(row[4])
-        confidence = row[8]
-        version = row[9]
-        bright_t31 = Decimal(row[10]) if row[10] else None
-        frp = Decimal(row[11]) if row[11] else None
-        daynight = row[12]
-
-        
+    if pairs:
         cur.execute("""
-            SELECT id, satellite FROM fires 
-            WHERE latitude = %s AND longitude = %s AND acq_date = %s AND acq_time = %s
-        """, (lat, lon, acq_date, acq_time))
-        result = cur.fetchone()
-
-        if result:
-            fire_id, existing_satellites = result
-            if satellite not in existing_satellites.split(','):
-                updated_satellites = existing_satellites + ',' + satellite
-                cur.execute("""
-                    UPDATE fires 
-                    SET satellite = %s 
-                    WHERE id = %s
-                """, (updated_satellites, fire_id))
-                updated_points += 1
-        else:
-            query = """
-                INSERT INTO fires (latitude, longitude, brightness, scan, track, acq_date, acq_time, local_time, satellite, confidence, version, bright_t31, frp, daynight, geom) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_GeomFromText('POINT(%s %s)', 4326)) 
-                RETURNING id
-            """
-            values = (lat, lon, brightness, scan, track, acq_date, acq_time, local_time, satellite, confidence, version,
-                      bright_t31, frp, daynight, lon, lat)
-
-            
-            cur.execute(query, values)
-            fire_id = cur.fetchone()[0]
-
-            forests = get_forests_for_point(lat, lon, cur)
-            if forests:
-                for forest_id in forests:
-                    cur.execute("""
-                        INSERT INTO fire_forest_relations (fire_id, forestry_id) 
-                        VALUES (%s, %s)
-                    """, (fire_id, forest_id))
-            added_points += 1
-        conn.commit()
-    except Exception as e:
-        logging.error(f"Error inserting or updating point: {e}")
-        conn.rollback()
-    return added_points, updated_points
-    
-    
-def process_file(file_path, cur, conn, satellite, current_points):
-    global total_points_all_files, points_within_kazakhstan_all_files, added_points_all_files, updated_points_all_files
-    total_points = 0
-    points_within_kazakhstan = 0
-    added_points = 0
-    updated_points = 0
+            INSERT INTO fire_forest_relations (fire_id, forestry_id)
+            SELECT * FROM unnest(%s::bigint[], %s::bigint[])
+        """, ([fire_id for fire_id, _ in pairs], [forestry_id for _, forestry_id in pairs]))
+        stats["forest_relations"] += cur.rowcount
+    if exact_ids:
+        cur.execute("""
+            INSERT INTO fire_forest_relations (fire_id, forestry_id)
+            SELECT f.id, g.forestry_id
+            FROM fires f
+            JOIN forestry_geometries g ON ST_Contains(g.geom, f.geom)
+            WHERE f.id = ANY(%s)
+        """, (exact_ids,))
+        stats["forest_relations"] += cur.rowcount
+    stats["forest_points_exact"] += len(exact_ids)
+    return stats
+
+def ingest_batch(batch, cur, conn, forest_cache=None):
+    stats = Counter()
+    create_staging_table(cur)
+    copy_batch_to_staging(batch, cur)
+    stats["points_within_kazakhstan"] = filter_staging_by_boundary(cur)
+    inserted, updated_ids = merge_staging_into_fires(cur)
+    stats["points_updated"] = len(updated_ids)
+    stats["points_added"] = len(inserted)
+
+    if inserted:
+        stats.update(create_forest_relations(inserted, cur, forest_cache))
+        logging.info(f"Created {stats['forest_relations']} fire-forest relations for {len(inserted)} new points")
+    # Сводка по лесничествам и дням обновляется в той же транзакции, что и сами точки
+    stats["aggregate_rows_updated"] = update_aggregates(cur, [fire_id for fire_id, _, _ in inserted], updated_ids)
+    conn.commit()
+    return stats
+
+def load_feed_file(file_path, satellite, boundary, manifest=None):
+    # Чтение и фильтрация одного файла без обращения к БД; в БД пишет общий этап после слияния
+    # Метрики копятся в самом результате: файл может читаться в отдельном процессе
+    feed = {"path": file_path, "batch": None, "signature": None, "fingerprints": None, "observed": None,
+            "stats": Counter(), "metrics": Counter()}
     try:
+        if manifest is not None:
+            feed["signature"] = file_signature(file_path, manifest)
+            if is_file_unchanged(manifest, file_path, feed["signature"]):
+                logging.info(f"File unchanged since last run, skipped: {file_path}")
+                feed["stats"]["files_skipped_unchanged"] += 1
+                return feed
+
         logging.info(f"Processing file: {file_path}")
-        with open(file_path, 'r') as file:
-            reader = csv.reader(file)
-            header = next(reader, None)
-            if not header:
-                logging.error(f"No data in file: {file_path}")
-                return
-            for row in reader:
-                total_points += 1
-                lat, lon = float(row[0]), float(row[1])
-                acq_date = row[5]
-                acq_time = row[6]
-                current_points.add((lat, lon, acq_date, acq_time))
-                if is_within_kazakhstan(lat, lon, cur):
-                    points_within_kazakhstan += 1
-                    added_points, updated_points = insert_or_update_db(row, cur, conn, satellite, added_points, updated_points)
-        total_points_all_files += total_points
-        points_within_kazakhstan_all_files += points_within_kazakhstan
-        added_points_all_files += added_points
-        updated_points_all_files += updated_points
-        logging.info(f"Finished processing file: {file_path}")
+        with timed(feed["metrics"], "parse"):
+            batch = read_firms_csv(file_path, satellite)
+        if batch is None:
+            logging.error(f"No data in file: {file_path}")
+            return feed
+        total_points = batch["size"]
+        feed["stats"]["files_processed"] += 1
+        feed["stats"]["points_total"] += total_points
+        feed["metrics"][metric_key("feed_bytes_read", satellite=satellite)] += os.path.getsize(file_path)
+        feed["metrics"][metric_key("feed_rows_read", satellite=satellite)] += total_points
+
+        # Дальше идут только строки, которых не было в предыдущих запусках
+        if manifest is not None and total_points:
+            observed = batch["observed"].astype(np.int64)
+            fingerprints = row_fingerprints(batch["latitude"], batch["longitude"], observed, satellite)
+            new_rows = np.flatnonzero(new_rows_mask(manifest, fingerprints))
+            feed["fingerprints"], feed["observed"] = fingerprints[new_rows], observed[new_rows]
+            batch = take_batch(batch, new_rows)
+            logging.info(f"{batch['size']} of {total_points} points in {file_path} are new")
+        feed["metrics"][metric_key("feed_rows_new", satellite=satellite)] += batch["size"]
+
+        # До PostGIS доходят только точки, прошедшие проверку по закэшированной границе
+        if batch["size"]:
+            candidates = batch["size"]
+            with timed(feed["metrics"], "spatial_filter"):
+                inside = points_in_boundary(boundary, batch["latitude"], batch["longitude"])
+            batch = take_batch(batch, np.flatnonzero(inside))
+            logging.info(f"Prefilter kept {batch['size']} of {candidates} points from {file_path}")
+        feed["metrics"][metric_key("feed_rows_inside", satellite=satellite)] += batch["size"]
+        feed["batch"] = batch
     except Exception as e:
         logging.error(f"Failed to process file {file_path}: {e}")
+        feed["stats"]["files_failed"] += 1
+        feed["batch"] = None
+        feed["signature"] = None
+    return feed
+
+def init_feed_worker(boundary, manifest):
+    worker_state["boundary"] = boundary
+    worker_state["manifest"] = manifest
+
+def load_feed_task(task):
+    file_path, satellite = task
+    return load_feed_file(file_path, satellite, worker_state["boundary"], worker_state["manifest"])
+
+def load_feeds(tasks, boundary, manifest, workers=None):
+    # executor.map сохраняет порядок задач, поэтому результат не зависит от того, какой процесс закончил первым
+    workers = max(1, min(workers or feed_workers, len(tasks)))
+    logging.info(f"Loading {len(tasks)} files with {workers} worker(s)")
+    if workers == 1:
+        init_feed_worker(boundary, manifest)
+        return [load_feed_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_feed_worker,
+                             initargs=(boundary, manifest)) as executor:
+        return list(executor.map(load_feed_task, tasks))
+
+def ingest_shard(batch, pool, forest_cache=None):
+    conn = pool.getconn()
+    try:
+        with stage_label("db_write"), conn.cursor() as cur:
+            return ingest_batch(batch, cur, conn, forest_cache)
+    except Exception:
         conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
 
-def process_data():
-    global total_files_processed
-    current_points = set()
-    with psycopg2.connect(**db_config) as conn, conn.cursor() as cur:
-        for satellite in os.listdir(download_directory):
-            satellite_directory = os.path.join(download_directory, satellite)
-            if os.path.isdir(satellite_directory):
-                for root, _, files in os.walk(satellite_directory):
-                    for file_name in files:
-                        if file_name.endswith('.csv'):
-                            logging.info(f"Found file: {file_name}")
-                            process_file(Path(root) / file_name, cur, conn, satellite, current_points)
-                            total_files_processed += 1
-
-        create_temp_table_for_current_points(cur, current_points)
-        logging.info(f"Temporary table created with {len(current_points)} points.")
-        conn.commit()
+def ingest_merged(merged, pool, totals, forest_cache=None):
+    # Ключи в разных частях не пересекаются, поэтому части пишутся параллельно без конфликтов строк
+    shard_count = max(1, min(db_pool_size, merged["size"] // min_rows_per_shard))
+    shards = shard_batch(merged, shard_count)
+    failed = False
+    with stage_timer("db_write"), ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(ingest_shard, shard, pool, forest_cache) for shard in shards]
+    for future in futures:
+        try:
+            totals.update(future.result())
+        except Exception as e:
+            logging.error(f"Failed to ingest merged batch: {e}")
+            failed = True
+    logging.info(f"Batch ingested in {len(shards)} part(s): {totals['points_added']} added, "
+                 f"{totals['points_updated']} updated")
+    return not failed
 
-if __name__ == "__main__":
-    process_data()
+def ingest_feeds(feeds, pool, totals, manifest=None, forest_cache=None):
+    merged, duplicates = merge_feeds([feed["batch"] for feed in feeds if feed["batch"] is not None])
+    failed = False
+    if merged is not None:
+        logging.info(f"Merged {merged['size'] + duplicates} points from {len(feeds)} files into "
+                     f"{merged['size']} unique observations")
+        totals["duplicates_merged"] += duplicates
+        failed = not ingest_merged(merged, pool, totals, forest_cache)
+
+    # Манифест обновляется только если все части зафиксированы; повтор упавшей части идемпотентен
+    if manifest is not None and not failed:
+        for feed in feeds:
+            if feed["signature"] is None:
+                continue
+            if feed["fingerprints"] is not None:
+                add_fingerprints(manifest, feed["fingerprints"], feed["observed"])
+            record_file(manifest, feed["path"], feed["signature"])
+    return not failed
+
+def find_feed_files(directory):
+    tasks = []
+    for satellite in sorted(os.listdir(directory)):
+        satellite_directory = os.path.join(directory, satellite)
+        if os.path.isdir(satellite_directory):
+            for root, _, files in os.walk(satellite_directory):
+                for file_name in sorted(files):
+                    if file_name.endswith('.csv'):
+                        logging.info(f"Found file: {file_name}")
+                        tasks.append((Path(root) / file_name, satellite))
+    return tasks
+
+def prepare_database(conn):
+    with conn.cursor() as cur:
+        apply_migrations(conn)
+        ensure_spatial_indexes(cur)
+        ensure_partitions(cur)
+    conn.commit()
+
+def create_connection_pool():
+    return psycopg2.pool.ThreadedConnectionPool(1, db_pool_size, cursor_factory=CountingCursor, **db_config)
+
+def process_data(directory=None, workers=None, pool=None, boundary=None, forest_cache=None):
+    # Долгоживущий процесс передает свои пул соединений, границу и кэш лесов; разовый запуск создает их сам
+    totals = Counter()
+    ingested = True
+    manifest = load_manifest(processed_directory) if incremental_mode else None
+    own_pool = pool is None
+    if own_pool:
+        pool = create_connection_pool()
+    try:
+        conn = pool.getconn()
+        try:
+            if own_pool:
+                prepare_database(conn)
+            with conn.cursor() as cur:
+                if boundary is None:
+                    boundary = load_boundary(cur, boundary_cache_path)
+                if forest_cache is None:
+                    forest_cache = load_forest_cache(cur, forest_cache_path)
+                else:
+                    refresh_forest_cache(cur, forest_cache)
+            conn.commit()
+        finally:
+            pool.putconn(conn)
+
+        # Сначала читаются все источники, затем одна объединенная пачка уходит в БД
+        tasks = find_feed_files(directory or download_directory)
+        feeds = load_feeds(tasks, boundary, manifest, workers) if tasks else []
+        for feed in feeds:
+            totals.update(feed["stats"])
+            add_metrics(feed["metrics"])
+        if feeds:
+            ingested = ingest_feeds(feeds, pool, totals, manifest, forest_cache)
+    finally:
+        if own_pool:
+            pool.closeall()
+
+    save_forest_cache(forest_cache, forest_cache_path)
+    if manifest is not None:
+        prune_manifest(manifest)
+        save_manifest(manifest, processed_directory)
+        logging.info(f"Manifest saved: {len(manifest['files'])} files, {len(manifest['fingerprints'])} row fingerprints")
+    # Файлы с незафиксированными строками не попали в манифест и будут обработаны в следующий запуск
+    if not ingested:
+        raise IngestError(f"Some parts of the merged batch were not written: {totals['points_added']} added, "
+                          f"{totals['points_updated']} updated before the failure")
+    return totals
+
+def log_run_totals(totals):
     logging.info('Finished processing all files.')
-    logging.info(f'Total files processed: {total_files_processed}')
-    logging.info(f'Total points processed: {total_points_all_files}')
-    logging.info(f'Total points within Kazakhstan: {points_within_kazakhstan_all_files}')
-    logging.info(f'Total points added to database: {added_points_all_files}')
-    logging.info(f'Total points updated in database: {updated_points_all_files}')
-
-    # Запуск второго скрипта для архивирования данных
-    subprocess.run(["/usr/local/bin/python3", "/app/FirmsProcessing/Scripts/archive_data.py"], check=True)
+    logging.info(f'Total files processed: {totals["files_processed"]}')
+    logging.info(f'Files skipped as unchanged: {totals["files_skipped_unchanged"]}')
+    logging.info(f'Files failed: {totals["files_failed"]}')
+    logging.info(f'Total points processed: {totals["points_total"]}')
+    logging.info(f'Cross-satellite duplicates merged in memory: {totals["duplicates_merged"]}')
+    logging.info(f'Total points within Kazakhstan: {totals["points_within_kazakhstan"]}')
+    logging.info(f'Total points added to database: {totals["points_added"]}')
+    logging.info(f'Total points updated in database: {totals["points_updated"]}')
+    logging.info(f'Aggregate rows updated: {totals["aggregate_rows_updated"]}')
+    logging.info(f'Forest lookup cache: {totals["forest_cache_hits"]} hits, {totals["forest_cache_misses"]} misses, '
+                 f'{totals["forest_points_exact"]} points checked exactly')
+
+def run_once():
+    with metered_run("process_data") as totals:
+        totals.update(process_data())
+        log_run_totals(totals)
+
+        # Архивирование выполняется в этом же процессе
+        from archive_data import archive_data
+        totals["points_archived"] = archive_data()
+
+if __name__ == "__main__":
+    from run_lock import run_single_flight
+    run_single_flight(run_once, "process_data.py")
 
 logging.info('Finished process_data script execution.')
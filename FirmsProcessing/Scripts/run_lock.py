@@ -0,0 +1,149 @@
+import fcntl
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+import psycopg2
+
+lock_directory = Path(os.getenv('PIPELINE_LOCK_DIRECTORY', '/app/FirmsProcessing/Cache'))
+host_lock_file = "pipeline.lock"
+# Запросы, пришедшие во время запуска: по строке на запрос, файл очищается перед каждым проходом
+rerun_file = "pipeline.rerun"
+db_lock_name = "firms_pipeline_run"
+# Запросы на повтор с других хостов: блокировку в БД держит запуск, до файла которого они не дотянутся
+db_rerun_table = "pipeline_rerun_requests"
+
+db_config = {
+    "host": os.getenv('DB_HOST', 'localhost'),
+    "dbname": os.getenv('DB_NAME'),
+    "user": os.getenv('DB_USER'),
+    "password": os.getenv('DB_PASSWORD')
+}
+
+def try_host_lock():
+    lock_directory.mkdir(parents=True, exist_ok=True)
+    lock_file = open(lock_directory / host_lock_file, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def release_host_lock(lock_file):
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+def request_rerun(source):
+    # Дозапись одной строки в режиме O_APPEND атомарна, поэтому одновременные запросы не теряются
+    lock_directory.mkdir(parents=True, exist_ok=True)
+    with open(lock_directory / rerun_file, 'a') as file:
+        file.write(f"{datetime.utcnow().isoformat(timespec='seconds')} {source}\n")
+
+def pending_reruns():
+    try:
+        return (lock_directory / rerun_file).read_text().splitlines()
+    except FileNotFoundError:
+        return []
+
+def take_reruns():
+    # Файл сначала переименовывается, поэтому запросы, пришедшие после этого, попадут в следующий проход
+    taken_path = lock_directory / (rerun_file + ".taken")
+    try:
+        os.replace(lock_directory / rerun_file, taken_path)
+    except FileNotFoundError:
+        return []
+    triggers = taken_path.read_text().splitlines()
+    taken_path.unlink()
+    return triggers
+
+def connect_lock_db():
+    conn = psycopg2.connect(**db_config)
+    with conn.cursor() as cur:
+        # Таблицу могут одновременно создавать запуски на разных хостах
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (db_rerun_table,))
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {db_rerun_table} (
+                id BIGSERIAL PRIMARY KEY,
+                source TEXT NOT NULL,
+                requested_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+    conn.commit()
+    # Сессионная блокировка на отдельном соединении держится весь запуск, через все транзакции этапов
+    conn.autocommit = True
+    return conn
+
+def try_db_lock(cur):
+    cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (db_lock_name,))
+    return cur.fetchone()[0]
+
+def acquire_db_lock(conn, source, coalesce=True):
+    # Блокировку держит запуск на другом хосте: не ждем его, а оставляем запрос в БД, который он проверит
+    with conn.cursor() as cur:
+        if try_db_lock(cur):
+            return True
+        if not coalesce:
+            return False
+        cur.execute(f"INSERT INTO {db_rerun_table} (source) VALUES (%s)", (source,))
+        # Владелец мог снять блокировку до появления запроса; тогда проход выполняем сами
+        if try_db_lock(cur):
+            return True
+    logging.info(f"Pipeline DB lock is held by a run on another host, trigger from {source} left as a rerun request")
+    return False
+
+def release_db_lock(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (db_lock_name,))
+
+def take_db_reruns(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {db_rerun_table} RETURNING requested_at, source")
+        return [f"{requested_at:%Y-%m-%dT%H:%M:%S} {source}" for requested_at, source in sorted(cur.fetchall())]
+
+def pending_db_reruns(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {db_rerun_table})")
+        return cur.fetchone()[0]
+
+def run_single_flight(run, source, rerun=None, coalesce=True):
+    # Вызов, пришедший во время чужого запуска, оставляет отметку и выходит; владелец блокировки повторит проход.
+    # rerun — проход конвейера для таких отметок, если run сам им не является (например, порция backfill.py);
+    # coalesce=False — не оставлять отметку, а только вернуть False, чтобы вызывающий попробовал позже
+    rerun = rerun or run
+    step = run
+    while True:
+        lock_file = try_host_lock()
+        if lock_file is None:
+            if coalesce:
+                request_rerun(source)
+                logging.info(f"Pipeline run already in progress, trigger from {source} coalesced into a rerun")
+            return False
+        try:
+            conn = connect_lock_db()
+            try:
+                if not acquire_db_lock(conn, source, coalesce):
+                    return False
+                while True:
+                    coalesced = take_reruns() + take_db_reruns(conn)
+                    if coalesced:
+                        logging.info(f"Rerunning pipeline for {len(coalesced)} coalesced trigger(s): "
+                                     f"{', '.join(coalesced)}")
+                    step()
+                    # Проход другого рода не покрывает запросы, взятые перед ним
+                    if coalesced and step is not rerun:
+                        rerun()
+                    step = rerun
+                    if not pending_reruns() and not pending_db_reruns(conn):
+                        break
+                release_db_lock(conn)
+                # Запрос с другого хоста мог прийти, пока блокировка еще держалась
+                db_rerun = pending_db_reruns(conn)
+            finally:
+                conn.close()
+        finally:
+            release_host_lock(lock_file)
+        # Запрос мог прийти между последней проверкой и снятием блокировки
+        if not db_rerun and not pending_reruns():
+            return True
@@ -0,0 +1,107 @@
+import csv
+from datetime import date
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy as np
+
+# Прямоугольник границы и сетка лесов тестовой базы; точки "внутри" генерируются в этом прямоугольнике
+bench_boundary = (50.0, 41.0, 85.0, 55.0)
+# Соседний регион Russia_Asia для точек за пределами границы
+outside_region = (86.0, 41.0, 120.0, 55.0)
+
+modis_header = ["latitude", "longitude", "brightness", "scan", "track", "acq_date", "acq_time", "satellite",
+                "confidence", "version", "bright_t31", "frp", "daynight"]
+viirs_header = ["latitude", "longitude", "bright_ti4", "scan", "track", "acq_date", "acq_time", "satellite",
+                "confidence", "version", "bright_ti5", "frp", "daynight"]
+# Заголовок и обозначение спутника в поле satellite, как в настоящих файлах FIRMS
+feed_formats = {
+    "MODIS_C6": (modis_header, ("T", "A"), "6.1NRT"),
+    "SUOMI_NPP_VIIRS_C2": (viirs_header, ("N",), "2.0NRT"),
+    "NOAA_20_VIIRS_C2": (viirs_header, ("1",), "2.0NRT"),
+    "NOAA_21_VIIRS_C2": (viirs_header, ("2",), "2.0NRT"),
+}
+
+def random_points(rng, size, inside_share):
+    inside = rng.random(size) < inside_share
+    lon = np.where(inside, rng.uniform(bench_boundary[0], bench_boundary[2], size),
+                   rng.uniform(outside_region[0], outside_region[2], size))
+    lat = np.where(inside, rng.uniform(bench_boundary[1], bench_boundary[3], size),
+                   rng.uniform(outside_region[1], outside_region[3], size))
+    return np.round(lat, 5), np.round(lon, 5)
+
+def random_observations(rng, size, inside_share, repeat_rate, days, end_date):
+    # Повтор пикселя: тот же пиксель горит в другое время, как многодневный пожар
+    lat, lon = random_points(rng, size, inside_share)
+    repeats = np.flatnonzero(rng.random(size) < repeat_rate)
+    repeats = repeats[repeats > 0]
+    sources = (rng.random(len(repeats)) * repeats).astype(np.int64)
+    lat[repeats], lon[repeats] = lat[sources], lon[sources]
+    acq_date = np.datetime64(end_date) - rng.integers(0, days, size).astype('timedelta64[D]')
+    acq_time = rng.integers(0, 24, size) * 100 + rng.integers(0, 60, size)
+    return {"latitude": lat, "longitude": lon, "acq_date": acq_date, "acq_time": acq_time}
+
+def feed_rows(rng, observations, satellite_codes, version, viirs):
+    size = len(observations["latitude"])
+    if viirs:
+        confidence = rng.choice(np.array(["l", "n", "h"]), size)
+    else:
+        confidence = rng.integers(0, 101, size).astype(str)
+    columns = [
+        observations["latitude"].tolist(),
+        observations["longitude"].tolist(),
+        np.round(rng.uniform(300, 400, size), 2).tolist(),
+        np.round(rng.uniform(0.3, 1.5, size), 2).tolist(),
+        np.round(rng.uniform(0.3, 1.5, size), 2).tolist(),
+        observations["acq_date"].astype(str).tolist(),
+        np.char.zfill(observations["acq_time"].astype(str), 4).tolist(),
+        rng.choice(np.array(satellite_codes), size).tolist(),
+        confidence.tolist(),
+        [version] * size,
+        np.round(rng.uniform(270, 300, size), 2).tolist(),
+        np.round(rng.uniform(0, 100, size), 2).tolist(),
+        np.where(rng.random(size) < 0.5, "D", "N").tolist(),
+    ]
+    return zip(*columns)
+
+def take_observations(observations, index):
+    return {column: values[index] for column, values in observations.items()}
+
+def generate_feeds(directory, feed_urls, rows, inside_share=0.3, overlap=0.2, repeat_rate=0.3, days=3,
+                   end_date=None, seed=0):
+    # Файлы раскладываются как на сервере FIRMS: <источник>/<имя файла из URL>.
+    # Доля overlap строк каждого источника — общие наблюдения, которые видят все спутники
+    rng = np.random.default_rng(seed)
+    end_date = end_date or date.today()
+    shared_rows = int(rows * overlap)
+    shared = random_observations(rng, shared_rows, inside_share, repeat_rate, days, end_date)
+
+    files = {}
+    for satellite, url in feed_urls.items():
+        header, satellite_codes, version = feed_formats[satellite]
+        own = random_observations(rng, rows - shared_rows, inside_share, repeat_rate, days, end_date)
+        observations = {column: np.concatenate([shared[column], own[column]]) for column in shared}
+        observations = take_observations(observations, rng.permutation(rows))
+
+        path = Path(directory) / satellite / Path(urlparse(url).path).name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(feed_rows(rng, observations, satellite_codes, version, header is viirs_header))
+        files[satellite] = path
+    return files
+
+def forest_squares(count, fill=0.8):
+    # Квадратные "леса" на регулярной сетке внутри границы; промежутки между ними дают ячейки на границе леса
+    per_side = max(1, int(np.ceil(np.sqrt(count))))
+    min_lon, min_lat, max_lon, max_lat = bench_boundary
+    step_lon = (max_lon - min_lon) / per_side
+    step_lat = (max_lat - min_lat) / per_side
+    squares = []
+    for index in range(count):
+        row, col = divmod(index, per_side)
+        lon = min_lon + col * step_lon
+        lat = min_lat + row * step_lat
+        squares.append((index + 1, lon, lat, lon + step_lon * fill, lat + step_lat * fill))
+    return squares
@@ -0,0 +1,9 @@
+import logging
+import sys
+from pathlib import Path
+
+# Скрипты импортируются по имени модуля, как при запуске из FirmsProcessing/Scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "Scripts"))
+
+# Обработчик у корневого логгера отключает запись модулей в /var/log/app.log во время тестов
+logging.getLogger().addHandler(logging.NullHandler())
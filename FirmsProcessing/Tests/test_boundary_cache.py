@@ -0,0 +1,19 @@
+import numpy as np
+
+from boundary_cache import build_boundary, points_in_boundary
+
+def square(min_x, min_y, max_x, max_y):
+    return np.array([[min_x, min_y], [max_x, min_y], [max_x, max_y], [min_x, max_y], [min_x, min_y]],
+                    dtype=np.float64)
+
+def test_overlapping_rows_are_united():
+    # Две пересекающиеся строки boundaries: точка в общей части лежит внутри границы
+    boundary = build_boundary([[square(0, 0, 10, 10)], [square(5, 5, 15, 15)]], "fingerprint")
+    lat = [7, 2, 12, 20]
+    lon = [7, 2, 12, 20]
+    assert points_in_boundary(boundary, lat, lon).tolist() == [True, True, True, False]
+
+def test_hole_inside_one_row():
+    # Дыра в полигоне одной строки остается дырой
+    boundary = build_boundary([[square(0, 0, 10, 10), square(4, 4, 6, 6)]], "fingerprint")
+    assert points_in_boundary(boundary, [5, 2], [5, 2]).tolist() == [False, True]
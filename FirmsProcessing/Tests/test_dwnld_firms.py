@@ -0,0 +1,139 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import dwnld_firms
+
+feed_content = b"latitude,longitude,acq_date\n48.1,68.2,2024-06-01\n"
+feed_etag = '"feed-v1"'
+feed_last_modified = "Sat, 01 Jun 2024 00:00:00 GMT"
+
+class FeedServer:
+    # Локальная замена сервера FIRMS; поведение задается полями перед запросом
+    def __init__(self):
+        self.content = feed_content
+        self.conditional = True
+        self.failures = 0
+        self.truncations = 0
+        self.requests = []
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if server.failures:
+                    server.failures -= 1
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if server.conditional and self.headers.get("If-None-Match") == feed_etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(server.content)))
+                if server.conditional:
+                    self.send_header("ETag", feed_etag)
+                    self.send_header("Last-Modified", feed_last_modified)
+                self.end_headers()
+                if server.truncations:
+                    # Обрыв соединения посреди тела ответа
+                    server.truncations -= 1
+                    self.wfile.write(server.content[:len(server.content) // 2])
+                    return
+                self.wfile.write(server.content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+@pytest.fixture
+def feed_server():
+    server = FeedServer()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), server.handler())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{httpd.server_address[1]}/csv/MODIS_C6_1_Russia_Asia_24h.csv"
+    yield server
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def session():
+    session = dwnld_firms.create_session(1)
+    yield session
+    session.close()
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(dwnld_firms, "backoff_seconds", 0)
+
+def download(session, feed_server, directory, state):
+    return dwnld_firms.download_feed(session, "MODIS_C6", feed_server.url, directory, state)
+
+def target_path(directory):
+    return directory / "MODIS_C6" / "MODIS_C6_1_Russia_Asia_24h.csv"
+
+def part_files(directory):
+    return list((directory / "MODIS_C6").glob("*.part"))
+
+def test_second_download_is_not_modified(session, feed_server, tmp_path):
+    changed, state = download(session, feed_server, tmp_path, {})
+    assert changed
+    assert target_path(tmp_path).read_bytes() == feed_content
+    assert state["etag"] == feed_etag
+    assert state["last_modified"] == feed_last_modified
+    assert state["sha256"] == hashlib.sha256(feed_content).hexdigest()
+
+    changed, second_state = download(session, feed_server, tmp_path, state)
+    assert not changed
+    assert second_state == state
+    assert feed_server.requests[-1]["If-None-Match"] == feed_etag
+    assert feed_server.requests[-1]["If-Modified-Since"] == feed_last_modified
+
+def test_identical_content_is_reported_unchanged(session, feed_server, tmp_path):
+    feed_server.conditional = False
+    changed, state = download(session, feed_server, tmp_path, {})
+    assert changed
+
+    changed, second_state = download(session, feed_server, tmp_path, state)
+    assert not changed
+    assert second_state["sha256"] == state["sha256"]
+    assert target_path(tmp_path).read_bytes() == feed_content
+    assert not part_files(tmp_path)
+
+def test_retries_after_service_unavailable(session, feed_server, tmp_path):
+    feed_server.failures = 1
+    changed, _ = download(session, feed_server, tmp_path, {})
+    assert changed
+    assert len(feed_server.requests) == 2
+    assert target_path(tmp_path).read_bytes() == feed_content
+
+def test_truncated_body_is_retried(session, feed_server, tmp_path):
+    feed_server.truncations = 1
+    changed, _ = download(session, feed_server, tmp_path, {})
+    assert changed
+    assert len(feed_server.requests) == 2
+    assert target_path(tmp_path).read_bytes() == feed_content
+    assert not part_files(tmp_path)
+
+def test_truncated_body_leaves_previous_file(session, feed_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(dwnld_firms, "max_attempts", 2)
+    _, state = download(session, feed_server, tmp_path, {})
+
+    feed_server.content = feed_content * 2
+    feed_server.conditional = False
+    feed_server.truncations = 2
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download(session, feed_server, tmp_path, state)
+    # Недокачанный файл не подменяет прежний и не остается рядом с ним
+    assert len(feed_server.requests) == 3
+    assert target_path(tmp_path).read_bytes() == feed_content
+    assert not part_files(tmp_path)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from firms_csv import iter_firms_csv, read_firms_csv
+
+viirs_csv = (
+    "latitude,longitude,bright_ti4,scan,track,acq_date,acq_time,satellite,confidence,version,bright_ti5,frp,daynight\n"
+    "48.10000,68.20000,330.5,0.39,0.36,2024-06-01,0912,N,n,2.0NRT,290.1,4.2,D\n"
+    "49.30000,70.10000,301.2,0.41,0.37,2024-06-01,2105,N,l,2.0NRT,280.4,,N\n"
+)
+
+def write_feed(tmp_path, encoding):
+    path = tmp_path / "SUOMI_VIIRS_C2_Russia_Asia_24h.csv"
+    path.write_text(viirs_csv, encoding=encoding)
+    return path
+
+def test_live_and_streaming_readers_accept_bom(tmp_path):
+    path = write_feed(tmp_path, 'utf-8-sig')
+    batch = read_firms_csv(path, "SUOMI_NPP_VIIRS_C2")
+    streamed = [chunk for chunk, _ in iter_firms_csv(path, "SUOMI_NPP_VIIRS_C2", chunk_rows=1)]
+
+    assert batch["size"] == 2
+    assert np.allclose(batch["latitude"], [48.1, 49.3])
+    assert [chunk["size"] for chunk in streamed] == [1, 1]
+    assert np.allclose(np.concatenate([chunk["latitude"] for chunk in streamed]), batch["latitude"])
+
+def test_reader_parses_columns_by_header(tmp_path):
+    batch = read_firms_csv(write_feed(tmp_path, 'utf-8'), "SUOMI_NPP_VIIRS_C2")
+
+    assert batch["acq_time"].tolist() == [9 * 60 + 12, 21 * 60 + 5]
+    assert np.allclose(batch["brightness"], [330.5, 301.2])
+    assert np.isnan(batch["frp"][1])
+
+def test_malformed_rows_are_dropped(tmp_path, caplog):
+    path = write_feed(tmp_path, 'utf-8')
+    with open(path, 'a') as file:
+        file.write("50.1,71.2,310.0,0.4,0.4,2024-06-01\n")
+        file.write("50.2,71.3,310.0,0.4,0.4,2024-06-01,,N,n,2.0NRT,281.0,3.0,D\n")
+        file.write("50.3,71.4,hot,0.4,0.4,2024-06-01,1200,N,n,2.0NRT,281.0,3.0,D\n")
+        file.write("50.4,71.5,310.0,0.4,0.4,2024-06-01,1300,N,n,2.0NRT,281.0,3.0,D\n")
+
+    batch = read_firms_csv(path, "SUOMI_NPP_VIIRS_C2")
+    streamed = [chunk for chunk, _ in iter_firms_csv(path, "SUOMI_NPP_VIIRS_C2", chunk_rows=3)]
+
+    assert np.allclose(batch["latitude"], [48.1, 49.3, 50.4])
+    assert batch["acq_time"].tolist()[-1] == 13 * 60
+    assert np.allclose(np.concatenate([chunk["latitude"] for chunk in streamed]), batch["latitude"])
+    assert "dropped 1 rows with a wrong number of fields and 2 rows with unparsable values" in caplog.text
@@ -0,0 +1,35 @@
+from collections import Counter
+
+import forest_cache
+
+class CellCursor:
+    # Вместо PostGIS: каждая запрошенная ячейка целиком лежит в лесу 7
+    def __init__(self):
+        self.classified = 0
+
+    def execute(self, query, params):
+        self.rows, self.cols = params[0], params[1]
+        self.classified += len(self.rows)
+
+    def fetchall(self):
+        return [(row, col, [7], False) for row, col in zip(self.rows, self.cols)]
+
+def test_lookup_bounds_cache_size(monkeypatch):
+    monkeypatch.setattr(forest_cache, "max_cached_cells", 10)
+    monkeypatch.setattr(forest_cache, "eviction_slack_cells", 2)
+    cache = forest_cache.empty_cache("fingerprint")
+    cur = CellCursor()
+    step = forest_cache.cell_degrees
+
+    for batch in range(20):
+        lat = [45 + (batch * 3 + offset) * step for offset in range(3)]
+        forests = forest_cache.lookup_forests(cache, cur, lat, [70.0] * 3, Counter())
+        assert forests == [(7,)] * 3
+        assert len(cache["cells"]) <= 12
+
+    # Последние ячейки остаются в кэше, повторный поиск не обращается к БД
+    classified = cur.classified
+    totals = Counter()
+    forest_cache.lookup_forests(cache, cur, lat, [70.0] * 3, totals)
+    assert cur.classified == classified
+    assert totals["forest_cache_hits"] == 3